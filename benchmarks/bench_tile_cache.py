@@ -0,0 +1,61 @@
+""" Micro-benchmark of Assets.get_tile_image against the old subsurface-per-call path.
+Run from the repo root: python benchmarks/bench_tile_cache.py """
+
+import os
+import sys
+import timeit
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame as pg
+
+from data.assets import Assets, TILE_SIZE
+from data.world import Tile
+
+
+def subsurface_tile_image(tile, flip_h=False):
+    # how get_tile_image used to work, a new subsurface on every call
+    if flip_h:
+        return Assets.tile_sheet_flipped.subsurface((Assets.tile_sheet_flipped.get_width() - (tile.value+1)*TILE_SIZE, 0, TILE_SIZE, TILE_SIZE))
+    else:
+        return Assets.tile_sheet.subsurface((tile.value*TILE_SIZE, 0, TILE_SIZE, TILE_SIZE))
+
+
+def main():
+    pg.init()
+    screen = pg.display.set_mode((1024, 768))
+    Assets.load_assets()
+    tiles = list(Tile)[1:]  # everything but OUT_OF_BOUNDS
+    calls = 200 * len(tiles) * 2
+
+    # both paths should give the same pixels
+    for tile in tiles:
+        for flip_h in (False, True):
+            old = pg.image.tobytes(subsurface_tile_image(tile, flip_h), "RGB")
+            new = pg.image.tobytes(Assets.get_tile_image(tile, flip_h), "RGB")
+            assert old == new, f"{tile} flip_h={flip_h} differs"
+
+    def lookup(get_image):
+        for i in range(200):
+            for tile in tiles:
+                get_image(tile, False)
+                get_image(tile, True)
+
+    def lookup_and_blit(get_image):
+        for i in range(200):
+            for tile in tiles:
+                screen.blit(get_image(tile, False), (0, 0))
+                screen.blit(get_image(tile, True), (0, 0))
+
+    for name, bench in (("lookup", lookup), ("lookup+blit", lookup_and_blit)):
+        for label, get_image in (("subsurface", subsurface_tile_image), ("cache", Assets.get_tile_image)):
+            best = min(timeit.repeat(lambda: bench(get_image), number=1, repeat=5))
+            print(f"{name:12} {label:10} {best / calls * 1e6:8.3f} us/call")
+
+    pg.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+""" Benchmark suite for the hot paths of the game: level generation, turn processing, item drops and drawing.
+Every scenario is seeded so runs are repeatable, and the results are written as JSON so runs from two commits can be diffed.
+
+Run from the repo root:
+    python benchmarks/run_benchmarks.py                        # all scenarios, writes bench_results.json
+    python benchmarks/run_benchmarks.py -k turn -o after.json  # only scenarios with "turn" in their name
+    python benchmarks/run_benchmarks.py --compare before.json  # also print the change against an older run
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pygame as pg
+
+from data.assets import Assets
+from data.effects import DAMAGE_COLOR, MAX_EFFECTS
+from data.game import Game, render_text
+from data.headless import run_headless_games
+from data.items import Item
+from data.mobs import Bat, Lizardman, Slime
+from data.render import Minimap
+from data.world import MazeGenerator, RoomGridGenerator, Tile, TileGrid
+
+SEED = 1234
+MOB_COUNTS = (10, 100, 1000, 10000)
+MAP_SIZES = (20, 50, 100, 200)
+
+
+def measure(fn, repeat, number=1):
+    """ Runs fn number times per sample, repeat samples, and returns timing stats in milliseconds per call. """
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) * 1000 / number)
+    return summarize(samples, number)
+
+
+def summarize(samples, number=1):
+    return {
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.mean(samples),
+        "repeat": len(samples),
+        "number": number,
+    }
+
+
+def make_arena(size):
+    """ Open room of floor with a wall border, so any number of mobs fits. """
+    tiles = TileGrid(size, size)
+    tiles.fill_rect(pg.Rect(1, 1, size - 2, size - 2), Tile.FLOOR)
+    return tiles, (size // 2, size // 2)
+
+
+def make_game(size, num_mobs, entity_store=False):
+    """ Headless game on an arena big enough to hold num_mobs at about 25% density. """
+    random.seed(SEED)
+    game = Game(headless=True, entity_store=entity_store, seed=SEED)
+    game.first_time = False
+    game.new_game()
+    game.world.load_level(*make_arena(size))
+    game.world.add_mob_at(game.player, *game.world.start_pos)
+    game.player.hp = 10**9  # the player must survive the whole benchmark
+
+    mob_types = (
+        lambda: Slime(game.world, game, Tile.SLIME, 6, 2, 0, game.player),
+        lambda: Bat(game.world, game, Tile.BAT, 10, 4, 0, game.player),
+        lambda: Lizardman(game.world, game, Tile.LIZARD, 20, 6, 2, game.player),
+    )
+    free = [(x, y) for y in range(1, size - 1) for x in range(1, size - 1) if (x, y) != game.world.start_pos]
+    for x, y in random.sample(free, num_mobs):
+        game.world.add_mob_at(random.choice(mob_types)(), x, y)
+    return game
+
+
+def arena_size(num_mobs):
+    return max(20, int((num_mobs * 4) ** 0.5) + 2)
+
+
+def bench_generate():
+    for size in MAP_SIZES:
+        def run(size=size):
+            generator = MazeGenerator(random.Random(SEED))
+            return measure(lambda: generator.generate(size, size), repeat=20)
+        yield f"generate/{size}x{size}", run
+    for size in MAP_SIZES + (2000,):
+        def run(size=size):
+            generator = RoomGridGenerator(random.Random(SEED))
+            return measure(lambda: generator.generate(size, size), repeat=20 if size < 2000 else 3)
+        yield f"generate/rooms/{size}x{size}", run
+
+
+def bench_turn():
+    for entity_store in (False, True):
+        for num_mobs in MOB_COUNTS:
+            def run(num_mobs=num_mobs, entity_store=entity_store):
+                game = make_game(arena_size(num_mobs), num_mobs, entity_store)
+
+                def turn():
+                    game.player.spent_turn = True
+                    game.on_update(0)
+
+                return measure(turn, repeat=20 if num_mobs < 10000 else 5)
+            yield f"turn/{'store/' if entity_store else ''}{num_mobs}_mobs", run
+
+
+def bench_add_item():
+    for size in (8, 12, 50, 200):
+        def run(size=size):
+            game = make_game(size, 0)
+            world = game.world
+
+            # cover the floor with items except for the far corner, then drop one more in the middle of the pile
+            for x, y in [(x, y) for y in range(1, size - 1) for x in range(1, size - 1)][1:]:
+                item = Item(Tile.POTION)
+                item.x, item.y = x, y
+                world.items.add(item)
+
+            def add_item():
+                item = Item(Tile.POTION)
+                world.add_item_at(item, size // 2 + 1, size // 2)  # next to the player
+                item.kill()
+
+            return measure(add_item, repeat=10)
+        yield f"add_item_at/{size}x{size}_crowded", run
+
+
+def bench_draw(surf):
+    for num_mobs in MOB_COUNTS:
+        for baked in (False, True):
+            def run(num_mobs=num_mobs, baked=baked):
+                game = make_game(arena_size(num_mobs), num_mobs)
+                game.baked_render = baked
+                game.on_draw(surf)  # bake outside of the timing
+                return measure(lambda: game.on_draw(surf), repeat=20 if num_mobs < 10000 or baked else 3)
+            size = arena_size(num_mobs)
+            yield f"draw/{'baked' if baked else 'classic'}/{num_mobs}_mobs_{size}x{size}", run
+
+    # generated levels, drawing should cost the same whatever the level size
+    for size in (20, 500, 2000):
+        for baked in (False, True):
+            def run(size=size, baked=baked):
+                game = Game(baked_render=baked, headless=True, map_size=(size, size), seed=SEED)
+                game.first_time = False
+                game.new_game()
+                game.on_draw(surf)
+                return measure(lambda: game.on_draw(surf), repeat=20)
+            yield f"draw/{'baked' if baked else 'classic'}/level_{size}x{size}", run
+
+    # the minimap of a level, made once per level, after which a frame costs the same whatever the level size
+    for size in (20, 1000):
+        def run_new(size=size):
+            game = Game(headless=True, map_size=(size, size), generator="rooms", seed=SEED)
+            game.first_time = False
+            game.new_game()
+            return measure(lambda: Minimap(game.world), repeat=10)
+        yield f"minimap/new/level_{size}x{size}", run_new
+
+        def run_draw(size=size):
+            game = Game(headless=True, map_size=(size, size), generator="rooms", seed=SEED)
+            game.first_time = False
+            game.new_game()
+            minimap = Minimap(game.world)
+            return measure(lambda: minimap.draw(surf, game.player, 40), repeat=20, number=10)
+        yield f"minimap/draw/level_{size}x{size}", run_draw
+
+
+def bench_ui(surf):
+    def run_draw_ui():
+        game = make_game(20, 0)
+        return measure(lambda: game.draw_ui(surf, 40), repeat=20, number=10)
+    yield "draw_ui", run_draw_ui
+
+    def run_draw_ui_changed():
+        game = make_game(20, 0)
+        game.player.max_hp = 30
+
+        def draw_ui():
+            game.player.hp = game.player.hp % 30 + 1  # the HUD has to be rebuilt every time
+            game.draw_ui(surf, 40)
+        return measure(draw_ui, repeat=20, number=10)
+    yield "draw_ui/changed", run_draw_ui_changed
+
+    texts = [f"Level: {i}  XP: {i*7}/{i*12}" for i in range(500)]
+
+    def run_hit():
+        return measure(lambda: render_text(Assets.small_font, texts[0], (245, 245, 245)), repeat=20, number=100)
+    yield "render_text/hit", run_hit
+
+    def miss():
+        render_text.cache_clear()
+        for text in texts:
+            render_text(Assets.small_font, text, (245, 245, 245))
+    yield "render_text/miss_500", lambda: measure(miss, repeat=10)
+
+    def run_float_texts():
+        # a full pool of damage numbers, with as many hits each frame as texts expire
+        game = make_game(20, 0)
+        game.float_texts.prerender()
+        pool = game.float_texts
+
+        def frame():
+            for i in range(4):
+                pool.add(f"-{i + 1}", i, 5, DAMAGE_COLOR)
+            pool.update(16)
+            game.draw_damage_text(surf)
+        for i in range(MAX_EFFECTS):
+            frame()
+        return measure(frame, repeat=20, number=10)
+    yield f"float_text/{MAX_EFFECTS}_live", run_float_texts
+
+
+def bench_startup():
+    yield "startup/load_title_assets", lambda: measure(Assets.load_title_assets, repeat=20)
+    yield "startup/load_game_assets", lambda: measure(Assets.load_game_assets, repeat=20)
+
+    def run_first_frame():
+        # time from process start to the first frame of the real game, as printed by --startup-time
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        samples = []
+        for i in range(5):
+            process = subprocess.Popen([sys.executable, "totlk.py", "--startup-time"], cwd=root, stdout=subprocess.PIPE, text=True)
+            for line in process.stdout:
+                if line.startswith("startup:"):
+                    samples.append(float(line.split()[-1].rstrip("s")) * 1000)
+                    break
+            process.kill()
+            process.wait()
+        return summarize(samples)
+    yield "startup/first_frame", run_first_frame
+
+
+def bench_headless():
+    def run():
+        results, turns_per_second = run_headless_games(5000, SEED)
+        return {"turns_per_second": turns_per_second, "games": len(results)}
+    yield "headless/bot_5000_turns", run
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", default="bench_results.json", help="where to write the results")
+    parser.add_argument("-k", "--filter", default="", help="only run scenarios whose name contains this")
+    parser.add_argument("--compare", help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+
+    pg.init()
+    screen = pg.display.set_mode((1024, 768))
+    surf = pg.Surface(screen.get_size()).convert()
+    Assets.load_assets()
+    Assets.load_headless()  # fonts and images are needed for drawing, but time the game logic without the mixer
+
+    results = {}
+    for bench in (bench_generate(), bench_turn(), bench_add_item(), bench_draw(surf), bench_ui(surf), bench_startup(), bench_headless()):
+        for name, run in bench:
+            if args.filter in name:
+                result = run()
+                results[name] = result
+                if "median_ms" in result:
+                    print(f"{name:45} {result['median_ms']:10.3f} ms")
+                else:
+                    print(f"{name:45} {result['turns_per_second']:10.0f} turns/s")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "meta": {
+                "seed": SEED,
+                "python": platform.python_version(),
+                "pygame": pg.version.ver,
+                "machine": platform.machine(),
+            },
+            "results": results,
+        }, f, indent=2, sort_keys=True)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)["results"]
+        print(f"\ncompared to {args.compare}:")
+        for name, result in results.items():
+            if name in old:
+                key = "median_ms" if "median_ms" in result else "turns_per_second"
+                print(f"{name:45} {old[name][key]:10.3f} -> {result[key]:10.3f}  ({result[key] / old[name][key]:.2f}x)")
+
+    pg.quit()
+
+
+if __name__ == "__main__":
+    main()
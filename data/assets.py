@@ -1,33 +1,136 @@
+import os.path
+import threading
+
 import pygame as pg
 
-TILE_SIZE = 60
+ASSET_CACHE_DIR = "data/cache"  # prescaled images made on the first launch, delete it to rebuild them
+TILE_SCALE = 3  # tiles are drawn at 3x the size of the tile sheet
+TILE_SIZE = 20 * TILE_SCALE
+
+SOUNDS = {
+    "step_sound": "data/sounds/Hit_Hurt5.wav",
+    "bump_sound": "data/sounds/Hit_Hurt4.wav",
+    "hit_sound": "data/sounds/Hit_Hurt22.wav",
+    "up_stairs_sound": "data/sounds/Hit_Hurt3.wav",
+    "powerup_sound": "data/sounds/Powerup6.wav",
+    "heal_sound": "data/sounds/Powerup12.wav",
+    "select_sound": "data/sounds/Blip_Select6.wav",
+    "game_over_sound": "data/sounds/Randomize39.wav",
+    "win_sound": "data/sounds/Powerup19.wav",
+}
+
+
+class NullSound:
+    """ Stands in for a pg.mixer.Sound when running without audio. """
+    def play(self, *args, **kwargs):
+        pass
+
+    def stop(self):
+        pass
+
+    def set_volume(self, volume):
+        pass
+
+
+class LazyAssets(type):
+    """ Lets Assets be used while start_loading is still loading it in the background: reading an asset that isn't
+    there yet waits for the loader to finish. """
+    def __getattr__(cls, name):
+        if name.startswith("__") or not cls.finish_loading():
+            raise AttributeError(f"type object 'Assets' has no attribute '{name}'")
+        return type.__getattribute__(cls, name)
+
+
+class Assets(metaclass=LazyAssets):
+    loader = None  # thread started by start_loading
+    loader_error = None
 
-class Assets:
     @staticmethod
     def load_assets():
-        # fonts
+        Assets.load_title_assets()
+        Assets.load_game_assets()
+
+    @staticmethod
+    def load_title_assets():
+        # what the title screen needs. Fonts are loaded here too, they are quick and the font renderer isn't thread safe
         Assets.big_font = pg.font.Font("freesansbold.ttf", 100)
         Assets.damage_font = pg.font.Font("freesansbold.ttf", 44)
         Assets.small_font = pg.font.Font("freesansbold.ttf", 20)
+        Assets.title_image = Assets.load_scaled_image("data/images/title.png", 5)
 
+    @staticmethod
+    def load_game_assets():
         # images
         Assets.tile_sheet_small = pg.image.load("data/images/tile_sheet.png").convert()   # save original size image for ui icons
-        Assets.tile_sheet = pg.transform.scale(Assets.tile_sheet_small, (Assets.tile_sheet_small.get_width()*3, Assets.tile_sheet_small.get_height()*3))
-        Assets.tile_sheet_flipped = pg.transform.flip(Assets.tile_sheet, True, False)
+        Assets.tile_sheet = Assets.load_scaled_image("data/images/tile_sheet.png", TILE_SCALE, original=Assets.tile_sheet_small)
+        Assets.tile_sheet_flipped = Assets.load_scaled_image("data/images/tile_sheet.png", TILE_SCALE, True, Assets.tile_sheet_small)
 
-        Assets.title_image = pg.image.load("data/images/title.png").convert()
-        Assets.title_image = pg.transform.scale(Assets.title_image, (Assets.title_image.get_width()*5, Assets.title_image.get_height()*5))
+        # slice every tile once, at game scale and flipped, so drawing doesn't make new subsurfaces each frame
+        tile_images = {}
+        for i in range(Assets.tile_sheet_small.get_width() // (TILE_SIZE // TILE_SCALE)):
+            tile_images[(i, False, TILE_SCALE)] = Assets.cut_tile_image(i, False, TILE_SCALE)
+            tile_images[(i, True, TILE_SCALE)] = Assets.cut_tile_image(i, True, TILE_SCALE)
+        Assets.tile_images = tile_images
 
         # sounds
-        Assets.step_sound = Assets.load_sound("data/sounds/Hit_Hurt5.wav")
-        Assets.bump_sound = Assets.load_sound("data/sounds/Hit_Hurt4.wav")
-        Assets.hit_sound = Assets.load_sound("data/sounds/Hit_Hurt22.wav")
-        Assets.up_stairs_sound = Assets.load_sound("data/sounds/Hit_Hurt3.wav")
-        Assets.powerup_sound = Assets.load_sound("data/sounds/Powerup6.wav")
-        Assets.heal_sound = Assets.load_sound("data/sounds/Powerup12.wav")
-        Assets.select_sound = Assets.load_sound("data/sounds/Blip_Select6.wav")
-        Assets.game_over_sound = Assets.load_sound("data/sounds/Randomize39.wav")
-        Assets.win_sound = Assets.load_sound("data/sounds/Powerup19.wav")
+        for name, filepath in SOUNDS.items():
+            setattr(Assets, name, Assets.load_sound(filepath))
+
+    @staticmethod
+    def start_loading():
+        """ Loads the game assets in a background thread, call after load_title_assets. """
+        def load():
+            try:
+                Assets.load_game_assets()
+            except Exception as e:
+                Assets.loader_error = e
+
+        Assets.loader = threading.Thread(target=load, name="asset loader", daemon=True)
+        Assets.loader.start()
+
+    @staticmethod
+    def finish_loading():
+        """ Waits for the background loader. Returns False if there was nothing to wait for. """
+        loader = Assets.loader
+        if loader is None:
+            return False
+        loader.join()
+        Assets.loader = None
+        if Assets.loader_error is not None:
+            error = Assets.loader_error
+            Assets.loader_error = None
+            raise error
+        return True
+
+    @staticmethod
+    def load_scaled_image(filepath, scale, flip_h=False, original=None):
+        """ Loads an image scaled up by scale, from the prescaled copy in ASSET_CACHE_DIR if it is up to date,
+        otherwise scales it and saves the copy for next time. """
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        cache_path = os.path.join(ASSET_CACHE_DIR, f"{name}_{scale}x{'_flipped' if flip_h else ''}.bmp")
+        try:
+            if os.path.getmtime(cache_path) >= os.path.getmtime(filepath):
+                return pg.image.load(cache_path).convert()
+        except (OSError, pg.error):
+            pass  # not made yet, or unreadable
+
+        if original is None:
+            original = pg.image.load(filepath).convert()
+        image = pg.transform.scale(original, (original.get_width()*scale, original.get_height()*scale))
+        if flip_h:
+            image = pg.transform.flip(image, True, False)
+        try:
+            os.makedirs(ASSET_CACHE_DIR, exist_ok=True)
+            pg.image.save(image, cache_path)
+        except (OSError, pg.error):
+            pass  # read only install, it will be scaled again next time
+        return image
+
+    @staticmethod
+    def load_headless():
+        # no display or mixer, so only silent sounds. Nothing is drawn so no fonts or images are needed
+        for name in SOUNDS:
+            setattr(Assets, name, NullSound())
 
     @staticmethod
     def load_sound(filepath, volume=0.4):
@@ -37,8 +140,38 @@ class Assets:
         return sound
 
     @staticmethod
-    def get_tile_image(tile, flip_h=False):
+    def get_tile_image(tile, flip_h=False, scale=TILE_SCALE):
+        image = Assets.tile_images.get((tile.value, flip_h, scale))
+        if image is None:
+            image = Assets.cache_tile_image(tile.value, flip_h, scale)
+        return image
+
+    @staticmethod
+    def cache_tile_image(tile_id, flip_h, scale):
+        image = Assets.cut_tile_image(tile_id, flip_h, scale)
+        Assets.tile_images[(tile_id, flip_h, scale)] = image
+        return image
+
+    @staticmethod
+    def cut_tile_image(tile_id, flip_h, scale):
+        if scale == TILE_SCALE:
+            # cut from the prescaled sheets
+            if flip_h:
+                sheet = Assets.tile_sheet_flipped
+                x = sheet.get_width() - (tile_id+1)*TILE_SIZE
+            else:
+                sheet = Assets.tile_sheet
+                x = tile_id*TILE_SIZE
+            return sheet.subsurface((x, 0, TILE_SIZE, TILE_SIZE)).copy()
+
+        # cut the tile out of the original size sheet, so any scale can be made (scale 1 for ui icons)
+        size = TILE_SIZE // TILE_SCALE
+        image = Assets.tile_sheet_small.subsurface((tile_id*size, 0, size, size))
+        if scale < 1:
+            # minimap cells, average the pixels instead of dropping most of them
+            image = pg.transform.smoothscale(image, (max(1, round(size*scale)), max(1, round(size*scale))))
+        elif scale != 1:
+            image = pg.transform.scale(image, (size*scale, size*scale))
         if flip_h:
-            return Assets.tile_sheet_flipped.subsurface((Assets.tile_sheet_flipped.get_width() - (tile.value+1)*TILE_SIZE, 0, TILE_SIZE, TILE_SIZE))
-        else:
-            return Assets.tile_sheet.subsurface((tile.value*TILE_SIZE, 0, TILE_SIZE, TILE_SIZE))
+            image = pg.transform.flip(image, True, False)
+        return image.convert()  # make an independent copy in the display's pixel format
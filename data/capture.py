@@ -0,0 +1,90 @@
+""" Saving screenshots and frame sequences without stalling the game.
+
+The main thread only copies the raw pixels out of the screen, a couple of ms. Converting, encoding and writing the
+PNG happens on a writer thread. pg.image.save holds the GIL while it encodes, which would stall the game anyway, so
+the PNG is put together here with zlib, which releases it.
+"""
+
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import zlib
+
+import pygame as pg
+
+QUEUE_SIZE = 8  # frames waiting to be written, about 3 MB each at 1024x768
+CAPTURE_DIR = "capture"  # where capture mode writes its frames
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+XRGB_MASKS = (0xff0000, 0xff00, 0xff)  # the usual 32 bit display format, whose raw bytes can be queued as is
+XRGB_FORMAT = "BGRA" if sys.byteorder == "little" else "ARGB"  # the same as a pg.image string format
+
+
+class ScreenshotWriter:
+    """ Writes PNG files from a queue on a background thread. The queue is bounded: when the writer falls behind,
+    save() waits for a free slot, slowing the game down instead of dropping frames or piling them up in memory. """
+    def __init__(self, max_queue=QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = None
+        self.next_nums = {}  # (directory, prefix) -> next free file number, from one scan of the directory
+
+    def save(self, surf, path):
+        """ Queues the current contents of surf to be written to path. """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.write_loop, name="screenshot writer", daemon=True)
+            self.thread.start()
+        width, height = surf.get_size()
+        if surf.get_bitsize() == 32 and surf.get_masks()[:3] == XRGB_MASKS and surf.get_pitch() == width*4:
+            pixels = (surf.get_buffer().raw, XRGB_FORMAT)  # converted on the writer thread
+        else:
+            pixels = (pg.image.tobytes(surf, "RGB"), "RGB")
+        self.queue.put((pixels, (width, height), path))
+
+    def next_path(self, directory, prefix, digits):
+        """ Returns the path of the next numbered file prefix<number>.png in directory. The directory is only
+        scanned the first time, numbers go up from the highest one found. """
+        key = (directory, prefix)
+        if key not in self.next_nums:
+            os.makedirs(directory, exist_ok=True)
+            pattern = re.compile(re.escape(prefix) + r"(\d+)\.png")
+            nums = [int(m.group(1)) for m in map(pattern.fullmatch, os.listdir(directory)) if m is not None]
+            self.next_nums[key] = max(nums, default=-1) + 1
+        num = self.next_nums[key]
+        self.next_nums[key] = num + 1
+        return os.path.join(directory, f"{prefix}{num:0{digits}d}.png")
+
+    def write_loop(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            (data, pixel_format), (width, height), path = job
+            if pixel_format != "RGB":
+                data = pg.image.tobytes(pg.image.frombuffer(data, (width, height), pixel_format), "RGB")
+            try:
+                with open(path, "wb") as f:
+                    f.write(encode_png(data, width, height))
+            except OSError as e:
+                print(f"can't save {path}: {e}")
+
+    def close(self):
+        """ Waits for the queued files to be written. """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+
+def encode_png(data, width, height):
+    """ Returns a PNG file of the 8 bit RGB pixels in data, in row order. """
+    stride = width * 3
+    # each row starts with its filter type, 0 for none
+    raw = b"".join(b"\x00" + data[y*stride:(y + 1)*stride] for y in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)  # 8 bits per channel, RGB, no interlace
+    return PNG_SIGNATURE + png_chunk(b"IHDR", header) + png_chunk(b"IDAT", zlib.compress(raw, 6)) + png_chunk(b"IEND", b"")
+
+
+def png_chunk(kind, body):
+    return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body))
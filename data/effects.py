@@ -0,0 +1,84 @@
+""" Floating damage and heal numbers, kept in a fixed pool so a busy fight doesn't allocate a sprite per hit. """
+
+from data.assets import Assets, TILE_SIZE
+
+MAX_EFFECTS = 64  # live float texts at most, when the pool is full a new one replaces the oldest
+EFFECT_DURATION = 300  # ms a float text stays up
+PRERENDERED_AMOUNTS = 50  # damage and heal amounts 1 to this are rendered up front
+DAMAGE_COLOR = (250, 61, 75)
+HEAL_COLOR = (0, 228, 48)
+
+
+class FloatTextPool:
+    """ Texts that rise from a tile for EFFECT_DURATION ms, like the damage numbers of a hit.
+    The texts live in MAX_EFFECTS slots of flat lists used as a ring buffer. Every text lasts as long, so they expire
+    in the order they were added, from the start of the ring. A text's rise and age come from the pool's frame and
+    time counters at the time it was added, so update() doesn't touch the live texts, only expires the old ones.
+    Images come from a table pre-rendered by prerender(), or from render(text, color) for anything else. """
+    def __init__(self, render, capacity=MAX_EFFECTS):
+        self.render = render
+        self.capacity = capacity
+        self.images = {}  # (text, color) -> surface, see prerender
+        self.image = [None] * capacity
+        self.left = [0] * capacity  # position of the image's top left corner in the level, in pixels
+        self.top = [0] * capacity
+        self.born_frame = [0] * capacity
+        self.born_time = [0] * capacity
+        self.start = 0  # slot of the oldest text
+        self.count = 0
+        self.frame = 0  # number of update() calls, texts rise a pixel each
+        self.time = 0  # sum of the dt given to update()
+
+    def __len__(self):
+        return self.count
+
+    def prerender(self):
+        """ Renders the usual damage and heal numbers, once the fonts are loaded. """
+        for amount in range(1, PRERENDERED_AMOUNTS + 1):
+            for text, color in ((f"-{amount}", DAMAGE_COLOR), (f"+{amount}", HEAL_COLOR)):
+                self.images[(text, color)] = Assets.damage_font.render(text, True, color)
+
+    def clear(self):
+        for i in range(self.capacity):
+            self.image[i] = None  # let go of the surfaces not in the table
+        self.start = 0
+        self.count = 0
+
+    def add(self, text, x, y, color):
+        """ Shows text rising from tile (x, y). """
+        image = self.images.get((text, color))
+        if image is None:
+            image = self.render(text, color)
+        if self.count == self.capacity:
+            # full, take the oldest slot
+            i = self.start
+            self.start = (self.start + 1) % self.capacity
+        else:
+            i = (self.start + self.count) % self.capacity
+            self.count += 1
+        width, height = image.get_size()
+        self.image[i] = image
+        self.left[i] = x*TILE_SIZE + TILE_SIZE//2 - width//2
+        self.top[i] = y*TILE_SIZE + TILE_SIZE//2 - height//2
+        self.born_frame[i] = self.frame
+        self.born_time[i] = self.time
+
+    def update(self, dt):
+        self.frame += 1
+        self.time += dt
+        while self.count > 0 and self.time - self.born_time[self.start] >= EFFECT_DURATION:
+            self.image[self.start] = None
+            self.start = (self.start + 1) % self.capacity
+            self.count -= 1
+
+    def draw(self, surf, scroll_x, scroll_y):
+        """ Draws the texts with the level scrolled by (scroll_x, scroll_y) in one blits() call, oldest first.
+        Returns the screen rects drawn on. """
+        if self.count == 0:
+            return []
+        frame = self.frame
+        blits = []
+        for n in range(self.count):
+            i = (self.start + n) % self.capacity
+            blits.append((self.image[i], (scroll_x + self.left[i], scroll_y + self.top[i] + self.born_frame[i] - frame)))
+        return surf.blits(blits)
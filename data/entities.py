@@ -0,0 +1,222 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from data.pathing import UNREACHED
+from data.scheduler import ACTION_COST, SLEEP_DISTANCE
+
+# neighbour offsets, in the same order Mob.wander and FlowField.next_step try them
+STEPS_X = (-1, 1, 0, 0)
+STEPS_Y = (0, 0, -1, 1)
+
+VIEW_FIELDS = ("x", "y", "hp")  # mob attributes that live in the arrays while the mob is in the store
+
+
+class EntityStore:
+    """ Optional struct-of-arrays storage for the monsters of a level, so thousands of them can be simulated.
+    Positions, hp, attack, defense, vision, speed and kind are kept in parallel NumPy arrays, and a whole turn of
+    AI (sight checks, hunt and wander steps, and sorting out who gets to move where) is done with array operations.
+    Mobs added to the store become thin views: their x, y and hp read and write the arrays, so drawing and combat
+    code keep working on Mob objects. Only mobs that bump into something fall back to Mob.move, one by one. """
+    def __init__(self, world, capacity=256):
+        if np is None:
+            raise ImportError("the entity store needs numpy")
+        self.world = world
+        self.rng = np.random.default_rng(world.rng.ai.getrandbits(64))
+        self.walkable = np.frombuffer(bytes(world.tiles.walkable_mask()), dtype=np.uint8)
+        self.view_classes = {}
+        self.kinds = {}  # mob class -> kind id, mobs only attack other kinds
+        self.mobs = []  # slot -> mob
+        self.free_slots = []
+        self.size = 0  # slots in use are all below this
+        self.x = np.zeros(capacity, np.int32)
+        self.y = np.zeros(capacity, np.int32)
+        self.hp = np.zeros(capacity, np.int32)
+        self.attack = np.zeros(capacity, np.int32)
+        self.defense = np.zeros(capacity, np.int32)
+        self.vision = np.zeros(capacity, np.float64)
+        self.speed = np.zeros(capacity, np.int32)
+        self.energy = np.zeros(capacity, np.int32)
+        self.kind = np.zeros(capacity, np.int16)
+        self.wanders = np.zeros(capacity, bool)
+        self.dives = np.zeros(capacity, bool)
+        self.alive = np.zeros(capacity, bool)
+
+    def grow(self):
+        for name in ("x", "y", "hp", "attack", "defense", "vision", "speed", "energy", "kind", "wanders", "dives", "alive"):
+            old = getattr(self, name)
+            new = np.zeros(len(old) * 2, old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def view_class(self, cls):
+        # subclass of the mob's class with x, y and hp backed by the arrays, made once per class
+        view = self.view_classes.get(cls)
+        if view is None:
+            attrs = {"__module__": cls.__module__}
+            for name in VIEW_FIELDS:
+                attrs[name] = array_property(name)
+            view = type(cls.__name__, (cls,), attrs)
+            self.view_classes[cls] = view
+        return view
+
+    def attach(self, mob):
+        """ Moves mob into the store. Its x, y and hp must be set. """
+        if len(self.free_slots) > 0:
+            slot = self.free_slots.pop()
+        else:
+            slot = self.size
+            self.size += 1
+            if slot == len(self.alive):
+                self.grow()
+            self.mobs.append(None)
+
+        cls = type(mob)
+        self.mobs[slot] = mob
+        self.attack[slot] = mob.attack_power
+        self.defense[slot] = mob.defense_power
+        self.vision[slot] = mob.vision
+        self.speed[slot] = mob.speed
+        self.energy[slot] = 0
+        self.kind[slot] = self.kinds.setdefault(cls, len(self.kinds))
+        self.wanders[slot] = cls.wanders
+        self.dives[slot] = cls.dives
+        self.alive[slot] = True
+
+        values = {name: mob.__dict__.pop(name) for name in VIEW_FIELDS}
+        mob.store = self
+        mob.slot = slot
+        mob.__class__ = self.view_class(cls)
+        for name, value in values.items():
+            setattr(mob, name, value)
+
+    def detach(self, mob):
+        """ Takes mob out of the store, it goes back to being a plain Mob. """
+        if getattr(mob, "store", None) is not self:
+            return
+        values = {name: getattr(mob, name) for name in VIEW_FIELDS}
+        mob.__class__ = type(mob).__bases__[0]
+        mob.__dict__.update(values)
+        self.alive[mob.slot] = False
+        self.mobs[mob.slot] = None
+        self.free_slots.append(mob.slot)
+        del mob.store
+        del mob.slot
+
+    def run_turn(self, player):
+        """ Runs one turn of AI for every monster in the store. Returns False if the player died. """
+        world = self.world
+        width = world.width
+        height = world.height
+        n = self.size
+        x = self.x[:n]
+        y = self.y[:n]
+
+        # mobs far from the player that it can't see are dormant and don't gain energy
+        world.update_fov(player)
+        fov = np.frombuffer(world.fov.visible, dtype=np.uint8)
+        near = np.maximum(np.abs(x - player.x), np.abs(y - player.y)) <= SLEEP_DISTANCE
+        active = self.alive[:n] & (near | (fov[y*width + x] == 1))
+        self.energy[:n][active] += self.speed[:n][active]
+        self.energy[:n][~active] = 0
+
+        steps_x = np.array(STEPS_X)
+        steps_y = np.array(STEPS_Y)
+        player_index = player.y*width + player.x
+
+        # act in rounds, fast mobs with energy left over get more rounds
+        while True:
+            acting = np.flatnonzero(self.alive[:n] & (self.energy[:n] >= ACTION_COST))
+            if len(acting) == 0:
+                return True
+            ax = x[acting]
+            ay = y[acting]
+
+            # sight goes both ways, so walls block it if the player can't see the mob either
+            sees = ((ax - player.x)**2 + (ay - player.y)**2 <= self.vision[acting]**2) & (fov[ay*width + ax] == 1)
+
+            nx = ax[:, None] + steps_x
+            ny = ay[:, None] + steps_y
+            in_bounds = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+            neighbors = np.where(in_bounds, ny*width + nx, 0)
+
+            # tiles taken by other mobs at the start of the round, the player's tile is handled as an attack
+            taken = np.sort(y[self.alive[:n]]*width + x[self.alive[:n]])
+            found = np.searchsorted(taken, neighbors).clip(max=len(taken) - 1)
+            occupied = (taken[found] == neighbors) & in_bounds
+
+            step = np.full(len(acting), -1)
+
+            # hunters walk down the shared flow field, preferring tiles nobody is on
+            if sees.any():
+                world.flow.update(player.x, player.y)
+                dist = np.frombuffer(world.flow.dist, dtype=np.uint16)  # a view, only the gathered values are cast
+                own = dist[ay*width + ax].astype(np.int32)
+                nd = np.where(in_bounds, dist[neighbors].astype(np.int32), UNREACHED)
+                closer = nd < own[:, None]
+                key = np.where(closer, nd + (occupied & (neighbors != player_index)) * 0x10000, 0x7FFFFFFF)
+                best = key.argmin(axis=1)
+                hunting = sees & closer.any(axis=1)
+                step[hunting] = best[hunting]
+
+                # too far for the flow field, head straight for the player like Mob.hunt
+                straight = sees & ~closer.any(axis=1)
+                dx = player.x - ax
+                dy = player.y - ay
+                straight_step = np.select([dx < 0, dx > 0, dy < 0, dy > 0], [0, 1, 2, 3], -1)
+                step[straight] = straight_step[straight]
+
+            # the others wander to a random walkable neighbour, if they are the wandering kind
+            wandering = ~sees & self.wanders[acting]
+            if wandering.any():
+                walkable = in_bounds & (self.walkable[neighbors] == 1)
+                score = np.where(walkable, self.rng.random(walkable.shape), -1.0)
+                choice = score.argmax(axis=1)
+                wandering &= walkable.any(axis=1)
+                step[wandering] = choice[wandering]
+
+            # pay for the action, diving bats spend everything they have
+            cost = np.where(sees & self.dives[acting], self.speed[acting], ACTION_COST)
+            self.energy[acting] -= cost
+
+            moving = step >= 0
+            rows = np.flatnonzero(moving)
+            target = neighbors[rows, step[rows]]
+
+            # steps onto free floor with no other mob heading there can all be done at once. The rest bump into
+            # something (a wall, a mob or the player) and go through Mob.move to attack or stop
+            free = in_bounds[rows, step[rows]] & (self.walkable[target] == 1) & ~occupied[rows, step[rows]] & (target != player_index)
+            order = np.argsort(target, kind="stable")
+            first = np.ones(len(rows), bool)
+            first[order[1:]] = target[order[1:]] != target[order[:-1]]
+            free &= first
+
+            mobs = self.mobs
+            group = world.mobs
+            for row, tile in zip(rows[free].tolist(), target[free].tolist()):
+                mob = mobs[acting[row]]
+                mx = STEPS_X[step[row]]
+                if mx != 0:
+                    mob.flip_h = mx < 0
+                group.move(mob, tile % width, tile // width)
+            # one step sound for all of them, if the player can see any
+            if (fov[target[free]] == 1).any() or (fov[ay[rows[free]]*width + ax[rows[free]]] == 1).any():
+                player.factory.sounds.play("step_sound")
+
+            for row in rows[~free].tolist():
+                slot = acting[row]
+                if self.alive[slot]:
+                    mobs[slot].move(STEPS_X[step[row]], STEPS_Y[step[row]])
+                    if player.hp <= 0:
+                        return False
+
+
+def array_property(name):
+    def get(self):
+        return int(getattr(self.store, name)[self.slot])
+
+    def set(self, value):
+        getattr(self.store, name)[self.slot] = value
+
+    return property(get, set)
@@ -0,0 +1,99 @@
+# transforms from octant coordinates to map coordinates, one column per octant
+OCTANTS = (
+    (1, 0, 0, -1, -1, 0, 0, 1),
+    (0, 1, -1, 0, 0, -1, 1, 0),
+    (0, 1, 1, 0, 0, -1, -1, 0),
+    (1, 0, 0, 1, -1, 0, 0, -1),
+)
+
+
+class FieldOfView:
+    """ What the player can see, as a bitmap with one byte per tile so it can be read in O(1).
+    Computed with recursive shadowcasting, so walls block sight and the cost only depends on the vision radius.
+    update() only recomputes when the viewer moved or invalidate() was called because the map changed. """
+    def __init__(self, tiles):
+        self.tiles = tiles
+        self.opaque = tiles.opaque_mask()
+        self.visible = bytearray(tiles.width * tiles.height)
+        self.cells = []  # visible (x, y) positions, so the bitmap can be cleared without touching the whole map
+        self.key = None
+
+    def invalidate(self):
+        self.opaque = self.tiles.opaque_mask()
+        self.key = None
+
+    def is_visible(self, x, y):
+        if 0 <= x < self.tiles.width and 0 <= y < self.tiles.height:
+            return self.visible[y*self.tiles.width + x] == 1
+        else:
+            return False
+
+    def update(self, x, y, radius):
+        """ Recomputes the field of view from (x, y) if needed. Returns True if it was recomputed. """
+        key = (x, y, radius)
+        if key == self.key:
+            return False
+        self.key = key
+
+        width = self.tiles.width
+        for cx, cy in self.cells:
+            self.visible[cy*width + cx] = 0
+        self.cells = []
+
+        if self.tiles.in_bounds(x, y):
+            self.light(x, y)
+            for i in range(8):
+                self.cast_light(x, y, 1, 1.0, 0.0, radius, OCTANTS[0][i], OCTANTS[1][i], OCTANTS[2][i], OCTANTS[3][i])
+        return True
+
+    def light(self, x, y):
+        i = y*self.tiles.width + x
+        if self.visible[i] == 0:
+            self.visible[i] = 1
+            self.cells.append((x, y))
+
+    def cast_light(self, cx, cy, row, start, end, radius, xx, xy, yx, yy):
+        # scans one octant row by row, recursing past the edges of walls, see
+        # http://www.roguebasin.com/index.php/FOV_using_recursive_shadowcasting
+        if start < end:
+            return
+        width = self.tiles.width
+        height = self.tiles.height
+        opaque_mask = self.opaque
+        radius_squared = radius * radius
+        new_start = 0.0
+
+        for j in range(row, int(radius) + 1):
+            dx = -j - 1
+            dy = -j
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                # slopes of the left and right edges of this cell
+                l_slope = (dx - 0.5) / (dy + 0.5)
+                r_slope = (dx + 0.5) / (dy - 0.5)
+                if start < r_slope:
+                    continue
+                elif end > l_slope:
+                    break
+
+                x = cx + dx*xx + dy*xy
+                y = cy + dx*yx + dy*yy
+                in_bounds = 0 <= x < width and 0 <= y < height
+                if in_bounds and dx*dx + dy*dy <= radius_squared:
+                    self.light(x, y)
+
+                opaque = not in_bounds or opaque_mask[y*width + x] == 1
+                if blocked:
+                    if opaque:
+                        new_start = r_slope
+                    else:
+                        blocked = False
+                        start = new_start
+                elif opaque and j < radius:
+                    # this wall starts a shadow, scan the lit part above it on the next rows
+                    blocked = True
+                    self.cast_light(cx, cy, j + 1, start, l_slope, radius, xx, xy, yx, yy)
+                    new_start = r_slope
+            if blocked:
+                break
@@ -1,16 +1,47 @@
 from enum import Enum
 from functools import lru_cache
-import os.path
-import random as rng
+import math
+import time
 
 import pygame as pg
 
+from data import save
 from data.assets import Assets, TILE_SIZE
+from data.capture import CAPTURE_DIR, ScreenshotWriter
+from data.effects import FloatTextPool
 from data.items import Item
 from data.mobs import Bat, Lizardman, Player, Slime
+from data.profiler import Profiler
 from data.quest import Quest
+from data.randomness import RandomStreams
+from data.render import LevelRenderer, Minimap
+from data.replay import InputRecorder, numbered_path, replay
+from data.sound import SoundDispatcher
 from data.world import Tile, World
 
+FPS = 60  # frame rate while something is animating
+IDLE_TIMEOUT = 1000  # ms to wait for an event before checking again when nothing is animating
+SAVE_PATH = "savegame.sav"  # where F5 saves and F9 loads
+TEXT_CACHE_SIZE = 256  # rendered texts kept by render_text, see render_text.cache_info() for hit/miss stats
+
+# numbers behind create_enemies_and_items, Game(spawn=...) overrides some of them for balance sweeps
+SPAWN = {
+    "base_enemies": 5,  # enemies on every level
+    "enemies_per_level": 1,  # more enemies as player levels up
+    "enemies_per_potion": 3,  # one potion for this many enemies
+}
+
+
+def check_spawn(spawn):
+    """ Raises ValueError if spawn has settings that aren't in SPAWN or values out of their range. """
+    unknown = set(spawn) - set(SPAWN)
+    if len(unknown) > 0:
+        raise ValueError(f"unknown spawn settings: {', '.join(sorted(unknown))}, the settings are {', '.join(SPAWN)}")
+    for name, value in spawn.items():
+        if not math.isfinite(value) or value < 0 or (name == "enemies_per_potion" and value == 0):
+            low = "more than 0" if name == "enemies_per_potion" else "0 or more"
+            raise ValueError(f"{name} must be a number {low}, not {value:g}")
+
 
 class State(Enum):
     TITLE = 0
@@ -21,9 +52,45 @@ class State(Enum):
 
 
 class Game:
-    def run(self):
+    def __init__(self, baked_render=True, headless=False, map_size=(20, 20), entity_store=False, event_driven=True, start_time=None,
+                 seed=None, record=None, generator="classic", profile_csv=None, capture_every=None, spawn=None):
+        self.map_size = map_size  # width and height of generated levels
+        self.generator = generator  # level generator, see world.GENERATORS
+        if spawn is not None:
+            check_spawn(spawn)
+        self.spawn = dict(SPAWN, **(spawn or {}))  # see SPAWN
+        self.entity_store = entity_store  # simulate monsters with array operations, needs numpy
+        self.event_driven = event_driven  # only redraw when something changed, instead of every frame
+        self.start_time = start_time  # time.perf_counter() at process start, to report the time to the first frame
+        self.seed = seed  # seed of every new game, random if None
+        self.record_path = record  # where to write an input log of the current game, see data/replay.py
+        self.recorder = None
+        self.games_recorded = 0
+        self.baked_render = baked_render  # draw the level from pre-rendered layers, see LevelRenderer
+        self.headless = headless  # no display or audio, see run_headless
+        self.sounds = SoundDispatcher()
+        self.float_texts = FloatTextPool(lambda text, color: render_text(Assets.damage_font, text, color))  # damage numbers
+        self.profiler = Profiler(profile_csv)  # P shows the frame timings, profile_csv also streams them to a file
+        self.screenshots = ScreenshotWriter()  # O saves a screenshot
+        if capture_every is not None and capture_every < 1:
+            raise ValueError(f"capture_every must be at least 1, not {capture_every}")
+        self.capture_every = capture_every  # save every Nth frame to CAPTURE_DIR, for making videos
+        self.quest = Quest()
+        self.world = None
+        self.player = None
+        self.renderer = None
+        self.minimap = None
+        self.show_minimap = True  # M toggles it
+        self.hud = None  # ui bar surface, only redrawn when what it shows changes
+        self.hud_key = None
+        self.last_draw_state = None
+        self.last_float_rects = []
+
+    def run(self, replay_path=None, replay_turn=None):
+        """ Opens the window and runs the game until it is closed. With replay_path, the game in that input log is
+        played back up to replay_turn (or to its end) before handing over to the player. """
         self.first_time = True
-        screenshot_num = 0
+        frame_num = 0
 
         # Basic setup
         pg.display.set_caption("Tomb of the Lizard King")
@@ -31,65 +98,194 @@ class Game:
         clock = pg.time.Clock()
         dt = 0
 
-        # Load resources
-        Assets.load_assets()
+        # Load what the title screen needs, the rest loads in the background while it is up
+        Assets.load_title_assets()
+        self.float_texts.prerender()
+        Assets.start_loading()
 
         # Show title screen when program starts
         self.state = State.TITLE
         # self.new_game() ##DEBUG
 
+        if replay_path is not None:
+            # fast forward, with nothing drawn or heard on the way
+            self.headless = True
+            replay(self, replay_path, replay_turn)
+            self.headless = False
+
         # Main game loop
+        redraw = True  # the whole screen needs drawing, whatever the state
+        last_key = None
+        profiler = self.profiler
         while True:
-            for event in pg.event.get():
+            events = pg.event.get()
+            if (self.event_driven and len(events) == 0 and not redraw and not self.is_animating() and not profiler.show_overlay
+                    and self.capture_every is None):
+                # nothing is moving, sleep until something happens instead of drawing the same frame again
+                events = [pg.event.wait(IDLE_TIMEOUT)] + pg.event.get()
+                clock.tick()  # the wait isn't frame time
+                dt = 0
+            profiler.begin_frame()
+
+            for event in events:
                 if event.type == pg.QUIT:
+                    profiler.close()
+                    self.screenshots.close()
                     return
+                elif event.type == pg.WINDOWEXPOSED:
+                    # the window contents may have been lost, update it all
+                    redraw = True
+                    self.last_draw_state = None
+                elif event.type == pg.KEYDOWN and event.key == pg.K_m:
+                    self.show_minimap = not self.show_minimap
+                    redraw = True
+                    self.last_draw_state = None  # the level under the minimap isn't in the dirty rects
+                elif event.type == pg.KEYDOWN and event.key == pg.K_p:
+                    profiler.toggle_overlay()
+                    redraw = True
+                    self.last_draw_state = None  # the overlay may cover more than the dirty rects
                 elif event.type == pg.KEYDOWN and event.key == pg.K_o:
-                    while True:
-                        filename = f"screenshot{screenshot_num:02d}.png"
-                        if not os.path.exists(filename):
-                            print(f"saving screenshot: {filename}")
-                            pg.image.save(screen, filename)
-                            break
-                        else:
-                            screenshot_num += 1
+                    filename = self.screenshots.next_path(".", "screenshot", 2)
+                    print(f"saving screenshot: {filename}")
+                    self.screenshots.save(screen, filename)
                 else:
                     self.on_event(event)
+            profiler.mark("events")
 
             self.on_update(dt)
-            self.on_draw(screen)
-
-            pg.display.flip()
-            dt = clock.tick(60)
+            profiler.mark("update")
+
+            key = self.redraw_key()
+            if redraw or key != last_key or self.is_animating() or not self.event_driven or profiler.show_overlay:
+                dirty_rects = self.on_draw(screen)
+                overlay_rect = profiler.draw(screen)
+                profiler.mark("profiler")
+                if dirty_rects is None:
+                    pg.display.flip()
+                else:
+                    if overlay_rect is not None:
+                        dirty_rects.append(overlay_rect)
+                    pg.display.update(dirty_rects)
+                profiler.mark("flip")
+                redraw = False
+                last_key = key
+
+                if self.start_time is not None:
+                    print(f"startup: first frame after {time.perf_counter() - self.start_time:.3f}s", flush=True)
+                    self.start_time = None
+
+            if self.capture_every is not None and frame_num % self.capture_every == 0:
+                self.screenshots.save(screen, self.screenshots.next_path(CAPTURE_DIR, "frame", 6))
+                profiler.mark("capture")
+            frame_num += 1
+            profiler.end_frame()
+            dt = clock.tick(FPS)
+
+    def redraw_key(self):
+        """ Changes whenever the screen needs redrawing because of something other than an animation:
+        a state change, a turn passing or a new level. """
+        if self.state == State.TITLE:
+            return (self.state,)
+        return (self.state, self.turn, self.floor)
+
+    def is_animating(self):
+        """ True while float texts are moving on the play screen, or one just went and has to be erased. """
+        return self.state == State.PLAY and (len(self.float_texts) > 0 or len(self.last_float_rects) > 0)
+
+    def run_headless(self, input_source, max_turns):
+        """ Plays one game with no display or audio as fast as possible, taking keys from input_source.
+        Stops when the game is over or after max_turns turns, and returns the results. """
+        self.headless = True
+        self.first_time = False  # skip the intro
+        Assets.load_headless()
+
+        start = time.perf_counter()
+        self.new_game()
+        while self.state in (State.PLAY, State.TALK) and self.turn < max_turns:
+            if self.state == State.TALK:
+                key = pg.K_RETURN  # dismiss text boxes
+            else:
+                key = input_source.next_key(self)
+            self.on_event(pg.event.Event(pg.KEYDOWN, key=key))
+            self.on_update(0)
+        return self.results(time.perf_counter() - start)
+
+    def results(self, seconds):
+        """ Summary of the game so far, for headless runs. """
+        return {
+            "state": self.state.name,
+            "turns": self.turn,
+            "level": self.player.level,
+            "floor": self.floor,
+            "treasures": self.quest.num_found(),
+            "seconds": seconds,
+        }
 
     def new_game(self):
-        Quest.reset()
-        self.float_group = pg.sprite.Group()  # used to draw floating damage numbers
+        self.quest = Quest()
+        self.float_texts.clear()
         self.state = State.PLAY
-        self.world = World()
+        self.turn = 0
+        self.floor = 1
+        self.rng = RandomStreams(self.seed)
+        self.new_world(*self.map_size, self.generator)
         self.new_player()
         self.create_enemies_and_items()
 
+        self.stop_recording()
+        if self.record_path is not None:
+            self.games_recorded += 1
+            self.recorder = InputRecorder(numbered_path(self.record_path, self.games_recorded), self)
+
         # intro
         if self.first_time:
             self.talking_time("You are trapped in the tomb of Necro-saurian kings.\nCollect the 3 treasures and climb up to escape.\nArrows keys to move, Space/Return to pass time or dismiss text boxes.", None)
             self.first_time = False
 
+    def new_world(self, width, height, generator, generate=True):
+        """ Replaces the world with one making width x height levels with generator. It starts on a new level, unless
+        generate is False for the caller to load one. """
+        if self.world is not None:
+            self.world.close()
+        self.world = World(width, height, entity_store=self.entity_store, rng=self.rng, pregenerate=not self.headless,
+                           generator=generator, generate=generate)
+        self.world.profiler = self.profiler
+
+    def save_game(self, path=SAVE_PATH):
+        """ Saves the game in progress, see data/save.py for the format. """
+        save.save_game(self, path)
+
+    def load_game(self, path=SAVE_PATH):
+        """ Replaces the game in progress, if any, with the one saved in path. """
+        if self.world is None:
+            self.rng = RandomStreams(self.seed)
+        save.load_game(self, path)
+        self.stop_recording()  # the rest of this game can't be replayed from its seed
+        self.float_texts.clear()
+        self.first_time = False
+        self.state = State.PLAY
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
     def new_player(self):
         self.player = Player(self.world, self)
         self.world.add_mob_at(self.player, *self.world.start_pos)
 
     def create_enemies_and_items(self):
-        num_enemies = 5 + self.player.level  # more enemies as player levels up
+        num_enemies = int(self.spawn["base_enemies"] + self.spawn["enemies_per_level"] * self.player.level)
         for i in range(num_enemies):
             # choose an enemy type
             if self.player.level == 1:
-                t = rng.randrange(0, 2)  # only slimes and bats at level 1
-            elif self.player.level < 5 and not Quest.has_shield:
-                t = rng.randrange(0, 3)  # lizardmen can spawn at low levels
+                t = self.rng.spawn.randrange(0, 2)  # only slimes and bats at level 1
+            elif self.player.level < 5 and not self.quest.has_shield:
+                t = self.rng.spawn.randrange(0, 3)  # lizardmen can spawn at low levels
             elif self.player.level < 6:
-                t = rng.randrange(0, 4)  # skeletons start to show up
+                t = self.rng.spawn.randrange(0, 4)  # skeletons start to show up
             else:
-                t = rng.randrange(0, 5)  # lizard knights can spawn
+                t = self.rng.spawn.randrange(0, 5)  # lizard knights can spawn
 
             # spawn enemy of the chosen type
             if t == 0:
@@ -113,17 +309,30 @@ class Game:
                 lizardknight.xp *= 4
                 self.world.add_mob_at_random_empty_pos(lizardknight)
 
-        num_items = num_enemies // 3
+        num_items = int(num_enemies // self.spawn["enemies_per_potion"])
         for i in range(num_items):
             self.world.add_item_at_random_empty_pos(Item(Tile.POTION))
 
     def new_float_text(self, text, x, y, color):
-        self.float_group.add(FloatText(text, x, y, color))
+        if self.headless:
+            return  # nothing to draw it on
+        self.float_texts.add(text, x, y, color)
 
     def on_event(self, event):
+        if self.recorder is not None and event.type == pg.KEYDOWN:
+            self.recorder.key(event.key)
+
+        if event.type == pg.KEYDOWN and event.key == pg.K_F9 and self.state in (State.TITLE, State.PLAY):
+            try:
+                self.load_game()
+                print(f"loaded game: {SAVE_PATH}")
+            except (OSError, save.SaveError) as e:
+                print(f"can't load game: {e}")
+            return
+
         if self.state == State.TITLE:
             if event.type == pg.KEYDOWN and (event.key == pg.K_SPACE or event.key == pg.K_RETURN):
-                Assets.select_sound.play()
+                self.sounds.play("select_sound")
                 self.new_game()
 
         elif self.state == State.PLAY:
@@ -138,6 +347,12 @@ class Game:
                     self.player.move(0, 1)
                 elif event.key == pg.K_SPACE or event.key == pg.K_RETURN:
                     self.player.spent_turn = True
+                elif event.key == pg.K_F5:
+                    try:
+                        self.save_game()
+                        print(f"saved game: {SAVE_PATH}")
+                    except (OSError, save.SaveError) as e:
+                        print(f"can't save game: {e}")
 
                 if self.world.get_tile(self.player.x, self.player.y) == Tile.UP_STAIRS:
                     self.up_stairs()
@@ -150,42 +365,81 @@ class Game:
 
         elif self.state == State.GAME_OVER:
             if event.type == pg.KEYDOWN and (event.key == pg.K_SPACE or event.key == pg.K_RETURN):
-                Assets.select_sound.play()
+                self.sounds.play("select_sound")
                 self.state = State.TITLE
 
         elif self.state == State.WIN:
             if event.type == pg.KEYDOWN and (event.key == pg.K_SPACE or event.key == pg.K_RETURN):
-                Assets.select_sound.play()
+                self.sounds.play("select_sound")
                 self.state = State.TITLE
 
+        if self.state not in (State.PLAY, State.TALK):
+            self.stop_recording()  # the game is over, the keys of the screens after it aren't part of it
+
     def on_update(self, dt):
+        if self.recorder is not None:
+            self.recorder.frame()
+
         if self.state == State.PLAY:
-            self.float_group.update(dt)  # make damage text disappear after a moment
+            self.float_texts.update(dt)  # make damage text disappear after a moment
 
             if self.player.spent_turn:
-                for mob in self.world.mobs:
-                    mob.update()
-
-                    # check if player was killed by last mob action
-                    if not self.player.alive():
-                        self.player.tile = Tile.SKULL
-                        self.world.mobs.add(self.player)
-                        self.state = State.GAME_OVER
-                        Assets.game_over_sound.play()
-                        break
+                self.turn += 1
+                if not self.world.run_turn(self.player):
+                    # player was killed by a mob action
+                    self.player.tile = Tile.SKULL
+                    self.world.mobs.add(self.player)
+                    self.state = State.GAME_OVER
+                    self.sounds.play("game_over_sound")
+                    self.stop_recording()
 
                 self.player.spent_turn = False
 
+        # play what was heard this frame, no one is listening when headless
+        if self.headless:
+            self.sounds.clear()
+        else:
+            self.sounds.flush(self.world, self.player)
+
     def on_draw(self, surf):
+        """ Draws the current state and returns the screen rects that changed, or None if the whole screen should be updated. """
         ui_size = 40
+        dirty_rects = None
 
+        profiler = self.profiler
         if self.state == State.TITLE:
             self.draw_title_screen(surf)
+            profiler.mark("title")
         else:
             surf.fill((0, 0, 0))
-            self.world.draw(surf, self.player, ui_size)
+            if self.baked_render:
+                if self.renderer is None or self.renderer.tiles is not self.world.tiles:
+                    self.renderer = LevelRenderer(self.world)  # new level
+                dirty_rects = self.renderer.draw(surf, self.player, ui_size)
+            else:
+                self.world.draw(surf, self.player, ui_size)
+            profiler.mark("world")
+            if self.minimap is None or self.minimap.tiles is not self.world.tiles:
+                self.minimap = Minimap(self.world)  # new level
+            if self.show_minimap:
+                minimap_rect = self.minimap.draw(surf, self.player, ui_size)
+                if dirty_rects is not None:
+                    dirty_rects.append(minimap_rect)
+            else:
+                self.minimap.update(self.player)  # keep track of what was seen
+            profiler.mark("minimap")
             self.draw_ui(surf, ui_size)
-            self.draw_damage_text(surf)
+            profiler.mark("ui")
+            float_rects = self.draw_damage_text(surf)
+            profiler.mark("damage_text")
+
+            # only the play screen is updated partially, overlays are redrawn whole
+            if dirty_rects is not None and self.state == State.PLAY and self.last_draw_state == State.PLAY:
+                dirty_rects += float_rects + self.last_float_rects
+                dirty_rects.append(pg.Rect(0, 0, surf.get_width(), ui_size + 1))
+            else:
+                dirty_rects = None
+            self.last_float_rects = float_rects
 
             if self.state == State.TALK:
                 self.draw_talk_box(surf)
@@ -193,8 +447,22 @@ class Game:
                 self.draw_game_over_screen(surf)
             elif self.state == State.WIN:
                 self.draw_win_screen(surf)
+            profiler.mark("overlays")
+
+        self.last_draw_state = self.state
+        return dirty_rects
 
     def draw_ui(self, surf, ui_size):
+        key = (surf.get_width(), ui_size, self.player.hp, self.player.max_hp, self.quest.num_found(),
+               self.player.level, self.player.xp, self.player.xp_needed)
+        if key != self.hud_key:
+            if self.hud is None or self.hud.get_size() != (surf.get_width(), ui_size + 1):
+                self.hud = pg.Surface((surf.get_width(), ui_size + 1)).convert()
+            self.render_hud(self.hud, ui_size)
+            self.hud_key = key
+        surf.blit(self.hud, (0, 0))
+
+    def render_hud(self, surf, ui_size):
         pg.draw.rect(surf, (32, 32, 32), (0, 0, surf.get_width(), ui_size))
 
         # draw health bar
@@ -204,7 +472,7 @@ class Game:
             pg.draw.rect(surf, color, (50 + i*7, 10, 5, 20))
 
         # draw quest items collected
-        draw_text(surf, Assets.small_font, f"Treasures: {Quest.num_found()}/3", 540, 11)
+        draw_text(surf, Assets.small_font, f"Treasures: {self.quest.num_found()}/3", 540, 11)
 
         # draw xp and level
         draw_text(surf, Assets.small_font, f"Level: {self.player.level}  XP: {self.player.xp}/{self.player.xp_needed}", surf.get_width() - 10, 10, "topright")
@@ -214,10 +482,7 @@ class Game:
     def draw_damage_text(self, surf):
         scroll_x = (surf.get_width() - TILE_SIZE) // 2 - self.player.x * TILE_SIZE
         scroll_y = (surf.get_height() - TILE_SIZE) // 2 - self.player.y * TILE_SIZE
-        for float_text in self.float_group:
-            rect = float_text.image.get_rect()
-            rect.center = (scroll_x + float_text.x*TILE_SIZE + TILE_SIZE/2, scroll_y + float_text.y*TILE_SIZE + TILE_SIZE/2 + float_text.y_offset)
-            surf.blit(float_text.image, rect)
+        return self.float_texts.draw(surf, scroll_x, scroll_y)
 
     def draw_talk_box(self, surf):
         talk_rect = pg.Rect(20, 60, surf.get_width() - 40, 200)
@@ -258,44 +523,27 @@ class Game:
     def up_stairs(self):
         tile = self.world.get_tile(self.player.x, self.player.y)
         if tile == Tile.UP_STAIRS:
-            Assets.up_stairs_sound.play()
+            self.sounds.play("up_stairs_sound")
 
             # check if player is able to escape the tomb
-            if Quest.can_escape():
+            if self.quest.can_escape():
                 self.player.kill()  # make player sprite disappear so it looks like they went up the stairs
-                Assets.win_sound.play()
+                self.sounds.play("win_sound")
                 self.state = State.WIN
             else:
                 # if not, just generate another level
+                self.floor += 1
                 self.world.new_level()
                 self.world.add_mob_at(self.player, *self.world.start_pos)
                 self.create_enemies_and_items()
                 self.player.spent_turn = False  # don't spend a turn climbinb stairs, otherwise enemies get a free attack
 
 
-class FloatText(pg.sprite.Sprite):
-    """ Displays some floating text in the play field. """
-    def __init__(self, text, x, y, color):
-        super().__init__()
-        self.image = render_text(Assets.damage_font, text, color)
-        self.x = x
-        self.y = y
-        self.duration = 300
-        self.y_offset = 0
-
-    def update(self, dt):
-        self.y_offset -= 1  # rising animation
-
-        self.duration -= dt
-        if self.duration <= 0:
-            self.kill()
-
-
 def draw_text(surf, font, text, x, y, anchor="topleft"):
     text_surf = render_text(font, text, (245, 245, 245))
     text_rect = text_surf.get_rect(**{anchor: (x, y)})
     surf.blit(text_surf, text_rect)
 
-@lru_cache
+@lru_cache(maxsize=TEXT_CACHE_SIZE)
 def render_text(font, text, color):
     return font.render(text, True, color)
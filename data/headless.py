@@ -0,0 +1,132 @@
+""" Input sources that drive a game without a player, for Game.run_headless, and runners for many such games. """
+
+from concurrent.futures import ProcessPoolExecutor
+import random
+import statistics
+import time
+
+import pygame as pg
+
+from data.assets import Assets
+from data.game import Game
+from data.replay import replay
+
+MOVE_KEYS = {(-1, 0): pg.K_LEFT, (1, 0): pg.K_RIGHT, (0, -1): pg.K_UP, (0, 1): pg.K_DOWN}
+
+
+class ScriptedInput:
+    """ Plays back a fixed list of keys, then waits (space) once the script runs out. """
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.pos = 0
+
+    def next_key(self, game):
+        if self.pos < len(self.keys):
+            key = self.keys[self.pos]
+            self.pos += 1
+            return key
+        return pg.K_SPACE
+
+
+class BotInput:
+    """ Simple AI player: attacks anything next to it, walks to items it can see, otherwise wanders. """
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.heading = (1, 0)
+
+    def next_key(self, game):
+        player = game.player
+        world = game.world
+
+        # attack an adjacent mob
+        for d in MOVE_KEYS:
+            if world.get_mob(player.x + d[0], player.y + d[1]) is not None:
+                return MOVE_KEYS[d]
+
+        # go for the nearest item in sight
+        r = int(player.vision) + 1
+        target = None
+        for item in world.items.in_rect(player.x - r, player.y - r, 2*r + 1, 2*r + 1):
+            if player.can_see(item.x, item.y):
+                if target is None or abs(item.x - player.x) + abs(item.y - player.y) < abs(target.x - player.x) + abs(target.y - player.y):
+                    target = item
+        if target is not None:
+            for d in ((sign(target.x - player.x), 0), (0, sign(target.y - player.y))):
+                if d != (0, 0) and world.is_walkable(player.x + d[0], player.y + d[1]):
+                    return MOVE_KEYS[d]
+
+        # keep walking the same way until hitting a wall, then turn somewhere random
+        if not world.is_walkable(player.x + self.heading[0], player.y + self.heading[1]) or self.rng.random() < 0.1:
+            choices = [d for d in MOVE_KEYS if world.is_walkable(player.x + d[0], player.y + d[1])]
+            if len(choices) == 0:
+                return pg.K_SPACE
+            self.heading = self.rng.choice(choices)
+        return MOVE_KEYS[self.heading]
+
+
+def sign(n):
+    return (n > 0) - (n < 0)
+
+
+def run_headless_games(total_turns, seed=None, **game_options):
+    """ Plays headless games with BotInput until total_turns turns have been played.
+    game_options are passed on to Game. Returns the results of each game and the overall turns per second. """
+    rng = random.Random(seed)
+    results = []
+    turns = 0
+    seconds = 0
+    while turns < total_turns:
+        game = Game(headless=True, seed=rng.randrange(2**32), **game_options)
+        result = game.run_headless(BotInput(rng.random()), total_turns - turns)
+        results.append(result)
+        turns += result["turns"]
+        seconds += result["seconds"]
+    return results, turns / seconds
+
+
+def play_headless_game(seed, bot_seed, max_turns, game_options):
+    """ Plays one headless game with BotInput. A top level function so worker processes can run it. """
+    game = Game(headless=True, seed=seed, **game_options)
+    result = game.run_headless(BotInput(bot_seed), max_turns)
+    result["seed"] = seed
+    return result
+
+
+def run_batch(num_games, max_turns, seed=None, workers=None, **game_options):
+    """ Plays num_games headless games with BotInput, up to max_turns turns each, spread over worker processes
+    (one per core by default). Games share nothing, so the results are the same whatever the number of workers.
+    game_options are passed on to Game, for example spawn settings to compare. Returns the results of each game,
+    in order. """
+    rng = random.Random(seed)
+    games = [(rng.randrange(2**32), rng.random()) for i in range(num_games)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(play_headless_game, game_seed, bot_seed, max_turns, game_options)
+                   for game_seed, bot_seed in games]
+        return [future.result() for future in futures]
+
+
+def summarize_results(results):
+    """ Aggregates the results of headless games: win rate, and how long and how far the player got. """
+    turns = [result["turns"] for result in results]
+    levels = [result["level"] for result in results]
+    return {
+        "games": len(results),
+        "win_rate": sum(result["state"] == "WIN" for result in results) / len(results),
+        "death_rate": sum(result["state"] == "GAME_OVER" for result in results) / len(results),
+        "mean_turns": statistics.mean(turns),
+        "median_turns": statistics.median(turns),
+        "mean_level": statistics.mean(levels),
+        "max_level": max(levels),
+        "mean_floor": statistics.mean(result["floor"] for result in results),
+        "mean_treasures": statistics.mean(result["treasures"] for result in results),
+    }
+
+
+def run_replay(path, until_turn=None):
+    """ Plays the game in an input log (see data/replay.py) back with no display or audio, as fast as possible,
+    up to until_turn if given. Returns the results like Game.run_headless. """
+    game = Game(headless=True)
+    Assets.load_headless()
+    start = time.perf_counter()
+    replay(game, path, until_turn)
+    return game.results(time.perf_counter() - start)
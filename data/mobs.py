@@ -1,13 +1,15 @@
-import random as rng
-
 import pygame as pg
 
-from data.assets import Assets
+from data.effects import DAMAGE_COLOR, HEAL_COLOR
 from data.items import Item
-from data.quest import Quest
+from data.scheduler import ACTION_COST
 from data.world import Tile
 
 class Mob(pg.sprite.Sprite):
+    batch_ai = True  # can be simulated by the EntityStore
+    wanders = False  # wanders around when it can't see its target
+    dives = False  # hunting takes its whole turn
+
     def __init__(self, world, factory, tile, max_hp, attack_power, defense_power):
         super().__init__()
         self.world = world
@@ -18,6 +20,7 @@ class Mob(pg.sprite.Sprite):
         self.attack_power = attack_power
         self.defense_power = defense_power
         self.vision = 0
+        self.speed = ACTION_COST  # energy gained per player turn, see TurnScheduler
         self.flip_h = False
 
     def move(self, mx, my):
@@ -36,22 +39,21 @@ class Mob(pg.sprite.Sprite):
             return
 
         if self.world.is_walkable(newx, newy):
-            Assets.step_sound.play()
-            self.x = newx
-            self.y = newy
+            self.factory.sounds.play("step_sound", self.x, self.y)
+            self.world.move_mob(self, newx, newy)
         else:
-            Assets.bump_sound.play()
+            self.factory.sounds.play("bump_sound", self.x, self.y)
 
     def attack(self, defender):
         attack_power = self.get_attack_power()
         defense_power = defender.get_defense_power()
         damage = max(1, attack_power - defense_power)
         defender.take_damage(damage)
-        Assets.hit_sound.play()
+        self.factory.sounds.play("hit_sound", self.x, self.y)
 
     def take_damage(self, damage):
         self.hp -= damage
-        self.factory.new_float_text(f"-{damage}", self.x, self.y, (250, 61, 75))
+        self.factory.new_float_text(f"-{damage}", self.x, self.y, DAMAGE_COLOR)
         if self.hp <= 0:
             self.kill()
             self.drop_loot()
@@ -69,6 +71,10 @@ class Mob(pg.sprite.Sprite):
     def can_see(self, x, y):
         return (self.x - x)**2 + (self.y - y)**2 <= self.vision**2
 
+    def can_see_target(self):
+        # sight goes both ways, so walls block it if the target (the player) can't see us either
+        return self.can_see(self.target.x, self.target.y) and self.target.can_see(self.x, self.y)
+
     def wander(self):
         choices = []
         if self.world.is_walkable(self.x-1, self.y):
@@ -81,10 +87,18 @@ class Mob(pg.sprite.Sprite):
             choices.append((0, 1))
 
         if len(choices) > 0:
-            move = rng.choice(choices)
+            move = self.world.rng.ai.choice(choices)
             self.move(*move)
 
     def hunt(self):
+        # follow the flow field to the target, it's only recomputed once per turn for all hunters
+        self.world.flow.update(self.target.x, self.target.y)
+        step = self.world.flow.next_step(self.x, self.y, self.world.mobs)
+        if step != None:
+            self.move(*step)
+            return
+
+        # too far for the flow field, just head straight for the target
         dx = self.target.x - self.x
         dy = self.target.y - self.y
         if dx < 0:
@@ -98,6 +112,8 @@ class Mob(pg.sprite.Sprite):
 
 
 class Player(Mob):
+    batch_ai = False
+
     def __init__(self, world, factory):
         super().__init__(world, factory, Tile.HERO, 30, 5, 0)
         self.vision = 5.2
@@ -106,6 +122,10 @@ class Player(Mob):
         self.xp = 0
         self.xp_needed = 12
 
+    def can_see(self, x, y):
+        self.world.update_fov(self)
+        return self.world.fov.is_visible(x, y)
+
     def move(self, mx, my):
         super().move(mx, my)
         self.spent_turn = True
@@ -117,24 +137,24 @@ class Player(Mob):
 
             # check if picked item was one of the three treasures
             if item.tile == Tile.SWORD:
-                Quest.has_sword = True
+                self.factory.quest.has_sword = True
                 self.tile = Tile.HERO_S
-                Assets.powerup_sound.play()
+                self.factory.sounds.play("powerup_sound")
                 new_attack_power = self.attack_power + 2
                 self.factory.talking_time(f"You've found the Necro-saurian Sword,\none of three legendary treasures!\nAttack power: {self.attack_power} -> {new_attack_power}", None)
                 self.attack_power = new_attack_power
 
             elif item.tile == Tile.SHIELD:
-                Quest.has_shield = True
+                self.factory.quest.has_shield = True
                 self.tile = Tile.HERO_SS
-                Assets.powerup_sound.play()
+                self.factory.sounds.play("powerup_sound")
                 new_defense_power = self.defense_power + 2
                 self.factory.talking_time(f"You've found the Necro-saurian Shield,\none of three legendary treasures!\nDefense power: {self.defense_power} -> {new_defense_power}", None)
                 self.defense_power = new_defense_power
 
             elif item.tile == Tile.CROWN:
-                Quest.has_crown = True
-                Assets.powerup_sound.play()
+                self.factory.quest.has_crown = True
+                self.factory.sounds.play("powerup_sound")
                 self.factory.talking_time(f"You've found the Necro-saurian Crown,\none of three legendary treasures!\nWith the crown's magic, you can escape\nthis tomb from the stairs.", None)
             
             # check if picked item is a potion
@@ -167,8 +187,8 @@ class Player(Mob):
         self.hp += amount
         if self.hp > self.max_hp:
             self.hp = self.max_hp
-        self.factory.new_float_text(f"+{amount}", self.x, self.y, (0, 228, 48))
-        Assets.heal_sound.play()
+        self.factory.new_float_text(f"+{amount}", self.x, self.y, HEAL_COLOR)
+        self.factory.sounds.play("heal_sound")
 
 
 class Lizardman(Mob):
@@ -180,24 +200,24 @@ class Lizardman(Mob):
         self.treasure_drop_rate = 0.2
 
     def update(self):
-        if self.can_see(self.target.x, self.target.y):
+        if self.can_see_target():
             self.hunt()
 
     def drop_loot(self):
-        Quest.kills_until_treasure -= 1
-        r = rng.random()
+        self.factory.quest.kills_until_treasure -= 1
+        r = self.world.rng.loot.random()
 
         # lizardmen can drop the three treasures, in order
-        if r < self.treasure_drop_rate and Quest.can_drop_treasure():
-            if not Quest.has_sword:
+        if r < self.treasure_drop_rate and self.factory.quest.can_drop_treasure():
+            if not self.factory.quest.has_sword:
                 self.world.add_item_at(Item(Tile.SWORD), self.x, self.y)
-                Quest.reset_kills()
-            elif not Quest.has_shield:
+                self.factory.quest.reset_kills()
+            elif not self.factory.quest.has_shield:
                 self.world.add_item_at(Item(Tile.SHIELD), self.x, self.y)
-                Quest.reset_kills()
-            elif not Quest.has_crown:
+                self.factory.quest.reset_kills()
+            elif not self.factory.quest.has_crown:
                 self.world.add_item_at(Item(Tile.CROWN), self.x, self.y)
-                Quest.reset_kills()
+                self.factory.quest.reset_kills()
             else:  # no more treasures, just drop a potion
                 self.world.add_item_at(Item(Tile.POTION), self.x, self.y)
         elif r < 0.4:
@@ -205,41 +225,45 @@ class Lizardman(Mob):
 
 
 class Slime(Mob):
+    wanders = True
+
     def __init__(self, world, factory, tile, max_hp, attack_power, defense_power, target):
         super().__init__(world, factory, tile, max_hp, attack_power, defense_power)
         self.target = target
         self.vision = 2
         self.xp = 4
+        self.speed = ACTION_COST // 2  # slime is slow, only moves every other turn
 
     def update(self):
-        num_turns = rng.randrange(0, 2)  # slime is slow, sometimes doesn't move
-        for i in range(num_turns):
-            if self.can_see(self.target.x, self.target.y):
-                self.hunt()
-            else:
-                self.wander()
+        if self.can_see_target():
+            self.hunt()
+        else:
+            self.wander()
 
     def drop_loot(self):
-        if rng.random() < 0.20:
+        if self.world.rng.loot.random() < 0.20:
             self.world.add_item_at(Item(Tile.POTION), self.x, self.y)
 
 
 class Bat(Mob):
+    wanders = True
+    dives = True
+
     def __init__(self, world, factory, tile, max_hp, attack_power, defense_power, target):
         super().__init__(world, factory, tile, max_hp, attack_power, defense_power)
         self.target = target
         self.vision = 2
         self.xp = 6
+        self.speed = ACTION_COST * 3 // 2  # bats flutter around, 3 moves every 2 turns
 
     def update(self):
-        if self.can_see(self.target.x, self.target.y):
+        if self.can_see_target():
             self.hunt()
+            return self.speed  # diving at the target takes the bat's whole turn
         else:
-            num_turns = rng.randrange(1, 3)
-            for i in range(num_turns):
-                self.wander()
+            self.wander()
 
     def drop_loot(self):
         # Bats are harder so have higher chance to drop a potion
-        if rng.random() < 0.4:
+        if self.world.rng.loot.random() < 0.4:
             self.world.add_item_at(Item(Tile.POTION), self.x, self.y)
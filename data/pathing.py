@@ -0,0 +1,172 @@
+from array import array
+from collections import deque
+
+UNREACHED = 0xFFFF
+
+
+class FlowField:
+    """ Walking distance from every tile near the goal (the player) to the goal, found with a BFS over walkable tiles.
+    One field is shared by every monster hunting the player, and each of them reads its next step in O(1).
+    Tiles further than max_distance are left unreached, so a rebuild only costs the area around the goal.
+    With incremental, a goal moving to a neighbouring tile repairs the field in place, only touching the tiles whose
+    distance changed. Moving one step changes the distance of most tiles in open rooms and corridors though, so for
+    bounded fields the plain rebuild is usually cheaper and is the default. """
+    def __init__(self, tiles, max_distance=24, incremental=False):
+        self.tiles = tiles
+        self.max_distance = max_distance
+        self.incremental = incremental
+        self.walkable = tiles.walkable_mask()
+        self.dist = array("H", [UNREACHED]) * (tiles.width * tiles.height)
+        self.reached = set()  # indices of the tiles with a distance, so the field can be cleared quickly
+        self.goal = None
+
+    def invalidate(self):
+        """ Call when the map changes. """
+        self.walkable = self.tiles.walkable_mask()
+        self.goal = None
+
+    def distance(self, x, y):
+        if 0 <= x < self.tiles.width and 0 <= y < self.tiles.height:
+            return self.dist[y*self.tiles.width + x]
+        else:
+            return UNREACHED
+
+    def update(self, x, y):
+        """ Moves the goal to (x, y). Returns True if the field changed. """
+        goal = (x, y)
+        if goal == self.goal:
+            return False
+
+        i = y*self.tiles.width + x
+        if self.incremental and self.goal is not None and abs(x - self.goal[0]) + abs(y - self.goal[1]) == 1 and self.dist[i] == 1:
+            old = self.goal[1]*self.tiles.width + self.goal[0]
+            self.add_goal(i)
+            self.remove_goal(old)
+        else:
+            self.rebuild(i)
+        self.goal = goal
+        return True
+
+    def next_step(self, x, y, mobs=None):
+        """ Returns the (dx, dy) step that gets closer to the goal from (x, y), or None if (x, y) was not reached.
+        Steps onto tiles with a mob on them are only taken if there is no free one. """
+        d = self.distance(x, y)
+        if d == UNREACHED:
+            return None
+        best = None
+        best_key = None
+        for dx, dy in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+            nd = self.distance(x + dx, y + dy)
+            if nd < d:
+                blocked = nd != 0 and mobs is not None and mobs.get(x + dx, y + dy) is not None
+                key = (blocked, nd)
+                if best_key is None or key < best_key:
+                    best = (dx, dy)
+                    best_key = key
+        return best
+
+    def neighbors(self, i):
+        width = self.tiles.width
+        x = i % width
+        if x > 0:
+            yield i - 1
+        if x < width - 1:
+            yield i + 1
+        if i >= width:
+            yield i - width
+        if i + width < len(self.dist):
+            yield i + width
+
+    def rebuild(self, goal):
+        dist = self.dist
+        walkable = self.walkable
+        for i in self.reached:
+            dist[i] = UNREACHED
+        self.reached = set()
+        if not walkable[goal]:
+            return
+
+        dist[goal] = 0
+        reached = self.reached
+        reached.add(goal)
+        width = self.tiles.width
+        last = len(dist) - width  # first index of the bottom row
+        frontier = [goal]
+        d = 0
+        while len(frontier) > 0 and d < self.max_distance:
+            d += 1
+            next_frontier = []
+            for i in frontier:
+                # neighbours inlined, this is the hot loop
+                x = i % width
+                for n in (i - 1 if x > 0 else -1, i + 1 if x < width - 1 else -1, i - width, i + width if i < last else -1):
+                    if n >= 0 and walkable[n] and dist[n] == UNREACHED:
+                        dist[n] = d
+                        reached.add(n)
+                        next_frontier.append(n)
+            frontier = next_frontier
+
+    def add_goal(self, goal):
+        # lower every tile that is now closer to the new goal than to the old one
+        dist = self.dist
+        walkable = self.walkable
+        dist[goal] = 0
+        queue = deque([goal])
+        while len(queue) > 0:
+            i = queue.popleft()
+            d = dist[i] + 1
+            if d > self.max_distance:
+                continue
+            for n in self.neighbors(i):
+                if walkable[n] and dist[n] > d:
+                    dist[n] = d
+                    self.reached.add(n)
+                    queue.append(n)
+
+    def remove_goal(self, goal):
+        dist = self.dist
+        walkable = self.walkable
+        max_distance = self.max_distance
+
+        # find the tiles whose every shortest path went through the old goal. They are visited in order of
+        # distance, so by the time a tile is checked every tile that could be supporting it is already decided
+        affected = set()
+        buckets = [[] for d in range(max_distance + 2)]
+        buckets[0].append(goal)
+        for d in range(max_distance + 1):
+            for i in buckets[d]:
+                if i in affected or dist[i] != d:
+                    continue
+                if i != goal and any(dist[n] == d - 1 and n not in affected for n in self.neighbors(i)):
+                    continue  # still has a shortest path that doesn't use the old goal
+                affected.add(i)
+                for n in self.neighbors(i):
+                    if walkable[n] and dist[n] == d + 1:
+                        buckets[d + 1].append(n)
+
+        # work out the new distances of those tiles from their unaffected neighbours
+        new_dist = {}
+        buckets = [[] for d in range(max_distance + 1)]
+        for i in affected:
+            best = UNREACHED
+            for n in self.neighbors(i):
+                if n not in affected and dist[n] < best:
+                    best = dist[n]
+            if best < max_distance:
+                new_dist[i] = best + 1
+                buckets[best + 1].append(i)
+        for i in affected:
+            dist[i] = UNREACHED
+            self.reached.discard(i)
+
+        for d in range(max_distance + 1):
+            for i in buckets[d]:
+                if dist[i] != UNREACHED or new_dist[i] != d:
+                    continue
+                dist[i] = d
+                self.reached.add(i)
+                if d < max_distance:
+                    for n in self.neighbors(i):
+                        if n in affected and dist[n] == UNREACHED and new_dist.get(n, UNREACHED) > d + 1:
+                            new_dist[n] = d + 1
+                            buckets[d + 1].append(n)
@@ -0,0 +1,140 @@
+""" Timing of each frame of Game.run, split in phases, for finding where the time of slow frames goes.
+
+Each frame is a sample: a dict of phase name -> milliseconds, plus "total" for the whole frame and "ai/<class>"
+entries for the time monsters of each type spent in update() (those are part of "update" too). The last HISTORY
+samples are kept for the overlay, and all of them can be streamed to a CSV file with one row per phase and frame.
+While the profiler is off, every call returns right away, so it costs next to nothing to leave the hooks in.
+"""
+
+import csv
+from collections import deque
+from time import perf_counter
+
+import pygame as pg
+
+HISTORY = 300  # frames kept for the overlay, 5 seconds at 60 fps
+PHASES = ("events", "update", "title", "world", "minimap", "ui", "damage_text", "overlays", "flip", "capture", "profiler")
+GRAPH_SCALE = 2  # pixels per ms in the frame time graph
+BUDGET_MS = 1000 / 60  # frame time of 60 fps, drawn as a line on the graph
+
+
+class Profiler:
+    """ Collects frame samples while enabled. Game.run calls begin_frame() at the start of each frame, mark() after
+    each phase and end_frame() at the end. If csv_path is given, the profiler is enabled from the start and every
+    sample is written to that file. """
+    def __init__(self, csv_path=None, history=HISTORY):
+        self.frames = deque(maxlen=history)  # ring buffer of the last samples
+        self.current = {}
+        self.frame_start = 0
+        self.last_mark = 0
+        self.frame_num = 0
+        self.show_overlay = False
+        self.font = None
+        self.csv_file = None
+        self.csv_writer = None
+        if csv_path is not None:
+            self.csv_file = open(csv_path, "w", newline="")
+            self.csv_writer = csv.writer(self.csv_file)
+            self.csv_writer.writerow(("frame", "phase", "ms"))
+        self.enabled = self.csv_file is not None
+
+    def toggle_overlay(self):
+        self.show_overlay = not self.show_overlay
+        self.enabled = self.show_overlay or self.csv_file is not None
+        if not self.enabled:
+            self.frames.clear()
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.current = {}
+        self.frame_start = self.last_mark = perf_counter()
+
+    def mark(self, phase):
+        """ Ends phase, which started at the previous mark or at the start of the frame. """
+        if not self.enabled:
+            return
+        now = perf_counter()
+        self.add(phase, now - self.last_mark)
+        self.last_mark = now
+
+    def add(self, name, seconds):
+        """ Adds seconds to name in the current sample, for timings that aren't a phase of their own. """
+        self.current[name] = self.current.get(name, 0) + seconds * 1000
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        sample = self.current
+        sample["total"] = (perf_counter() - self.frame_start) * 1000
+        self.frames.append(sample)
+        self.frame_num += 1
+        if self.csv_writer is not None:
+            self.csv_writer.writerows((self.frame_num, name, f"{ms:.3f}") for name, ms in sample.items())
+
+    def close(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
+
+    def percentiles(self, *ps):
+        """ Returns the frame times in ms at the given percentiles of the frames kept. """
+        totals = sorted(sample["total"] for sample in self.frames)
+        if len(totals) == 0:
+            return [0] * len(ps)
+        return [totals[min(len(totals) - 1, int(p / 100 * len(totals)))] for p in ps]
+
+    def draw(self, surf):
+        """ Draws the overlay in the bottom left corner of surf and returns its rect, or None if it is hidden.
+        Shows a graph of the frame times, their percentiles, and the average time of each phase next to its time in
+        the slowest frame kept. """
+        if not self.show_overlay:
+            return None
+        if self.font is None:
+            self.font = pg.font.Font("freesansbold.ttf", 12)
+        frames = self.frames
+        names = [name for name in PHASES if any(name in sample for sample in frames)]
+        names += sorted({name for sample in frames for name in sample if name.startswith("ai/")})
+        line = self.font.get_linesize()
+        graph_height = 80
+        rect = pg.Rect(0, 0, max(HISTORY, 240) + 20, graph_height + line * (len(names) + 3) + 30)
+        rect.bottomleft = (0, surf.get_height())
+
+        overlay = pg.Surface(rect.size)
+        overlay.set_alpha(210)
+        overlay.fill((16, 16, 24))
+
+        # frame times, oldest on the left, with the 60 fps budget as a line
+        base = 10 + graph_height
+        for i, sample in enumerate(frames):
+            ms = sample["total"]
+            color = (90, 200, 90) if ms <= BUDGET_MS else (230, 41, 55)
+            h = min(graph_height, int(ms * GRAPH_SCALE) + 1)
+            pg.draw.line(overlay, color, (10 + i, base), (10 + i, base - h))
+        budget_y = base - int(BUDGET_MS * GRAPH_SCALE)
+        pg.draw.line(overlay, (245, 245, 245), (10, budget_y), (rect.width - 10, budget_y))
+
+        p50, p95, p99, worst = self.percentiles(50, 95, 99, 100)
+        y = base + 10
+        self.draw_line(overlay, f"frame ms  p50 {p50:.1f}  p95 {p95:.1f}  p99 {p99:.1f}  max {worst:.1f}", 10, y)
+        y += line + 5
+        self.draw_line(overlay, "phase", 10, y)
+        self.draw_line(overlay, "avg ms", 160, y)
+        self.draw_line(overlay, "slowest", 230, y)
+        y += line
+
+        slowest = max(frames, key=lambda sample: sample["total"]) if len(frames) > 0 else {}
+        for name in names:
+            average = sum(sample.get(name, 0) for sample in frames) / len(frames)
+            self.draw_line(overlay, name, 10, y)
+            self.draw_line(overlay, f"{average:.2f}", 160, y)
+            self.draw_line(overlay, f"{slowest.get(name, 0):.2f}", 230, y)
+            y += line
+
+        surf.blit(overlay, rect)
+        return rect
+
+    def draw_line(self, surf, text, x, y):
+        # not through render_text, these change every frame and would push the HUD texts out of its cache
+        surf.blit(self.font.render(text, True, (245, 245, 245)), (x, y))
@@ -1,24 +1,23 @@
 class Quest:
-    @staticmethod
-    def reset():
-        Quest.has_sword = False
-        Quest.has_shield = False
-        Quest.has_crown = False
-        Quest.min_kills_until_treasure = 5  # stop treasures from dropping twice in a row
-        Quest.reset_kills()
+    """ Progress towards escaping the tomb, one per game. """
+    def __init__(self):
+        self.reset()
 
-    @staticmethod
-    def num_found():
-        return int(Quest.has_sword) + int(Quest.has_shield) + int(Quest.has_crown)
+    def reset(self):
+        self.has_sword = False
+        self.has_shield = False
+        self.has_crown = False
+        self.min_kills_until_treasure = 5  # stop treasures from dropping twice in a row
+        self.reset_kills()
 
-    @staticmethod
-    def can_escape():
-        return Quest.has_sword and Quest.has_shield and Quest.has_crown
+    def num_found(self):
+        return int(self.has_sword) + int(self.has_shield) + int(self.has_crown)
 
-    @staticmethod
-    def can_drop_treasure():
-        return Quest.kills_until_treasure <= 0
+    def can_escape(self):
+        return self.has_sword and self.has_shield and self.has_crown
 
-    @staticmethod
-    def reset_kills():
-        Quest.kills_until_treasure = Quest.min_kills_until_treasure
\ No newline at end of file
+    def can_drop_treasure(self):
+        return self.kills_until_treasure <= 0
+
+    def reset_kills(self):
+        self.kills_until_treasure = self.min_kills_until_treasure
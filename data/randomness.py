@@ -0,0 +1,18 @@
+import random
+
+STREAMS = ("level", "spawn", "ai", "loot")
+
+
+class RandomStreams:
+    """ The random number generators of one game, all derived from one seed so a game can be played again exactly.
+    Each part of the game draws from its own stream, so for example an extra wander roll doesn't change the loot:
+        level   maze generation
+        spawn   where and which monsters and items are placed
+        ai      monster wandering and scheduling
+        loot    loot drops """
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = random.randrange(2**32)
+        self.seed = seed
+        for name in STREAMS:
+            setattr(self, name, random.Random(f"{seed}/{name}"))
@@ -0,0 +1,168 @@
+from collections import OrderedDict
+
+import pygame as pg
+
+from data.assets import Assets, TILE_SCALE, TILE_SIZE
+
+CHUNK_TILES = 8  # chunks are 8x8 tiles
+CHUNK_SIZE = CHUNK_TILES * TILE_SIZE
+MINIMAP_SIZE = (200, 150)  # size of the minimap on screen
+MINIMAP_CELL = 3  # pixels per tile on the minimap
+MINIMAP_MAX_SIZE = 2048  # the minimap surface of a level is at most this wide or high, tiles get fewer pixels past it
+
+
+class LevelRenderer:
+    """ Draws a level from pre-rendered chunks instead of blitting every tile every frame.
+    Each chunk is a surface showing the tiles of that part of the level in the player's field of view. Chunks are made
+    when they first come on screen and are patched once per turn, only for the cells that came into or went
+    out of view, so the cost of a frame depends on the screen size and not on the level size. """
+    def __init__(self, world, max_chunks=48):
+        self.world = world
+        self.tiles = world.tiles
+        self.max_chunks = max_chunks  # least recently drawn chunks are dropped past this
+        self.chunks = OrderedDict()
+        self.visible = set()
+        self.view_key = None
+
+        # what was drawn last frame, to know which parts of the screen changed
+        self.last_scroll = None
+        self.last_rects = []
+
+    def get_chunk(self, cx, cy):
+        chunk = self.chunks.get((cx, cy))
+        if chunk is None:
+            chunk = pg.Surface((CHUNK_SIZE, CHUNK_SIZE)).convert()
+            chunk.fill((0, 0, 0))
+            for y in range(cy*CHUNK_TILES, min(self.world.height, (cy+1)*CHUNK_TILES)):
+                for x in range(cx*CHUNK_TILES, min(self.world.width, (cx+1)*CHUNK_TILES)):
+                    if (x, y) in self.visible:
+                        chunk.blit(self.world.get_image(x, y), ((x % CHUNK_TILES)*TILE_SIZE, (y % CHUNK_TILES)*TILE_SIZE))
+            self.chunks[(cx, cy)] = chunk
+            if len(self.chunks) > self.max_chunks:
+                self.chunks.popitem(last=False)
+        else:
+            self.chunks.move_to_end((cx, cy))
+        return chunk
+
+    def redraw_tile(self, x, y, visible=None):
+        """ Call when a tile of the level changes, or comes into or goes out of view. """
+        chunk = self.chunks.get((x // CHUNK_TILES, y // CHUNK_TILES))
+        if chunk is None:
+            return  # will be drawn when the chunk is made
+        rect = ((x % CHUNK_TILES)*TILE_SIZE, (y % CHUNK_TILES)*TILE_SIZE, TILE_SIZE, TILE_SIZE)
+        if visible is None:
+            visible = (x, y) in self.visible
+        if visible:
+            chunk.blit(self.world.get_image(x, y), rect)
+        else:
+            chunk.fill((0, 0, 0), rect)
+
+    def update_visibility(self, player):
+        # visibility only changes when the player moves
+        self.world.update_fov(player)
+        if self.world.fov.cells is self.view_key:
+            return
+        self.view_key = self.world.fov.cells
+
+        visible = set(self.world.fov.cells)
+        for x, y in self.visible - visible:
+            self.redraw_tile(x, y, False)
+        for x, y in visible - self.visible:
+            self.redraw_tile(x, y, True)
+        self.visible = visible
+
+    def draw(self, surf, player, ui_size):
+        """ Draws the level and returns the list of screen rects that changed since the last frame,
+        or None if the whole view changed. """
+        self.update_visibility(player)
+
+        # leave some space at the top for ui
+        draw_rect = pg.Rect(0, ui_size, surf.get_width(), surf.get_height() - ui_size)
+
+        # calculate scroll so player will be in center
+        scroll_x = (surf.get_width() - TILE_SIZE) // 2 - player.x * TILE_SIZE
+        scroll_y = (surf.get_height() - TILE_SIZE) // 2 - player.y * TILE_SIZE + 20  # +20 because of the ui
+
+        # draw the chunks that are on screen
+        left, top, right, bottom = self.world.view_bounds(draw_rect, scroll_x, scroll_y)
+        blits = []
+        for cy in range(top // CHUNK_TILES, (bottom - 1) // CHUNK_TILES + 1):
+            for cx in range(left // CHUNK_TILES, (right - 1) // CHUNK_TILES + 1):
+                blits.append((self.get_chunk(cx, cy), (scroll_x + cx*CHUNK_SIZE, scroll_y + cy*CHUNK_SIZE)))
+        clip = surf.get_clip()
+        surf.set_clip(draw_rect)
+        surf.blits(blits, False)
+        surf.set_clip(clip)
+
+        # draw items and mobs
+        r = int(player.vision) + 1
+        view = (player.x - r, player.y - r, 2*r + 1, 2*r + 1)
+        blits = []
+        for item in self.world.items.in_rect(*view):
+            if (item.x, item.y) in self.visible:
+                blits.append((Assets.get_tile_image(item.tile), (scroll_x + item.x*TILE_SIZE, scroll_y + item.y*TILE_SIZE)))
+        for mob in self.world.mobs.in_rect(*view):
+            if (mob.x, mob.y) in self.visible:
+                blits.append((Assets.get_tile_image(mob.tile, mob.flip_h), (scroll_x + mob.x*TILE_SIZE, scroll_y + mob.y*TILE_SIZE)))
+        rects = [pg.Rect(pos, (TILE_SIZE, TILE_SIZE)) for image, pos in blits]
+        surf.blits(blits, False)
+
+        scroll = (scroll_x, scroll_y, self.view_key, self.tiles)
+        if scroll != self.last_scroll:
+            dirty = None
+        else:
+            dirty = [rect for rect in rects + self.last_rects if rect.colliderect(draw_rect)]
+        self.last_scroll = scroll
+        self.last_rects = rects
+        return dirty
+
+
+class Minimap:
+    """ Map of the parts of the level the player has seen, drawn in a corner of the screen.
+    The whole level has one surface with a few pixels per tile, made black when the level is new. Cells are drawn
+    on it from tile_sheet_small when they are first seen, so a turn costs as much as the field of view, and a frame
+    is one blit of the part of the surface around the player, whatever the size of the level. """
+    def __init__(self, world):
+        self.world = world
+        self.tiles = world.tiles
+        self.cell = max(1, min(MINIMAP_CELL, MINIMAP_MAX_SIZE // max(world.width, world.height)))
+        self.scale = self.cell / (TILE_SIZE // TILE_SCALE)  # of tile_sheet_small
+        self.surface = pg.Surface((world.width * self.cell, world.height * self.cell)).convert()
+        self.surface.fill((0, 0, 0))
+        self.seen = bytearray(world.width * world.height)
+        self.view_key = None
+
+    def redraw_tile(self, x, y):
+        """ Call when a tile of the level changes. """
+        if self.seen[y*self.world.width + x]:
+            image = Assets.get_tile_image(self.world.get_tile(x, y), scale=self.scale)
+            self.surface.blit(image, (x*self.cell, y*self.cell))
+
+    def update(self, player):
+        """ Draws the cells that came into view since the last call. """
+        self.world.update_fov(player)
+        if self.world.fov.cells is self.view_key:
+            return
+        self.view_key = self.world.fov.cells
+
+        width = self.world.width
+        seen = self.seen
+        for x, y in self.view_key:
+            if not seen[y*width + x]:
+                seen[y*width + x] = 1
+                self.redraw_tile(x, y)
+
+    def draw(self, surf, player, ui_size):
+        """ Draws the minimap in the top right corner of surf, centered on the player, and returns its rect. """
+        self.update(player)
+        rect = pg.Rect(0, 0, *MINIMAP_SIZE)
+        rect.topright = (surf.get_width() - 10, ui_size + 10)
+        cell = self.cell
+        area = rect.copy()
+        area.center = (player.x*cell + cell//2, player.y*cell + cell//2)
+
+        surf.fill((0, 0, 0), rect)  # for the parts of the area past the edges of the level
+        surf.blit(self.surface, (rect.x - min(area.x, 0), rect.y - min(area.y, 0)), area.clip(self.surface.get_rect()))
+        surf.fill((245, 245, 245), (rect.centerx - cell//2 - 1, rect.centery - cell//2 - 1, cell + 2, cell + 2))
+        pg.draw.rect(surf, (245, 245, 245), rect, 1)
+        return rect
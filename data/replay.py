@@ -0,0 +1,89 @@
+""" Recording the keys pressed in a game, and playing them back.
+
+A log is a text file. The first line is a JSON header with the game's seed and options, and each line after
+that is a key code, or "-" where the game ran a frame (Game.on_update) after some keys. Games are fully decided by
+their seed and keys, so playing the log back on a new Game with the same options gives the same game.
+"""
+
+import json
+import os
+
+import pygame as pg
+
+LOG_VERSION = 1
+FILE_KEYS = (pg.K_F5, pg.K_F9)  # save and load, they touch files outside the log so they are neither logged nor replayed
+
+
+def numbered_path(path, num):
+    """ Path of the log of the num-th game of a session recorded to path: path itself for the first one, then
+    name-2.ext, name-3.ext... so a new game doesn't overwrite the log of the last one. """
+    if num == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}-{num}{ext}"
+
+
+class InputRecorder:
+    """ Writes a log of one game as it is played. The log is flushed every frame, so it survives a crash. """
+    def __init__(self, path, game):
+        self.file = open(path, "w")
+        header = {
+            "version": LOG_VERSION,
+            "seed": game.rng.seed,
+            "map_size": list(game.map_size),
+            "entity_store": game.entity_store,
+            "generator": game.generator,
+            "spawn": game.spawn,
+            "intro": game.first_time,
+        }
+        self.file.write(json.dumps(header) + "\n")
+        self.pending = False  # keys were written since the last frame
+
+    def key(self, key):
+        if key in FILE_KEYS:
+            return
+        self.file.write(f"{key}\n")
+        self.pending = True
+
+    def frame(self):
+        if self.pending:
+            self.file.write("-\n")
+            self.file.flush()
+            self.pending = False
+
+    def close(self):
+        self.frame()
+        self.file.close()
+
+
+def read_log(path):
+    """ Returns the header of the log in path, and its events: key codes, and None for frames. """
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get("version") != LOG_VERSION:
+            raise ValueError(f"{path} is not a version {LOG_VERSION} input log")
+        events = [None if line.strip() == "-" else int(line) for line in f if line.strip() != ""]
+    return header, events
+
+
+def replay(game, path, until_turn=None):
+    """ Starts a new game on game with the seed and options logged in path and plays the logged keys on it, as fast
+    as possible. Stops before the first key of turn until_turn if given. Returns True if the whole log was played. """
+    header, events = read_log(path)
+    game.seed = header["seed"]
+    game.map_size = tuple(header["map_size"])
+    game.entity_store = header["entity_store"]
+    game.generator = header.get("generator", "classic")
+    game.spawn = dict(game.spawn, **header.get("spawn", {}))
+    game.first_time = header["intro"]
+    game.new_game()
+
+    for event in events:
+        if event is None:
+            game.on_update(0)
+        elif event not in FILE_KEYS:  # older logs have them
+            if until_turn is not None and game.turn >= until_turn:
+                return False
+            game.on_event(pg.event.Event(pg.KEYDOWN, key=event))
+    game.on_update(0)
+    return True
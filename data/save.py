@@ -0,0 +1,188 @@
+""" Saving and restoring a game in progress, in a compact binary format.
+
+A save file is, all little endian:
+    header      HEADER, with the level size, the size and generator of the levels after it, the offset of the
+                tile data and the number of records
+    player      PLAYER record
+    mobs        one MOB record per monster
+    items       one ITEM record per item
+    tiles       width*height tile ids in row order, the same layout as TileGrid.cells
+
+Records are fixed width so reading them is a single unpack each, and the tile data is stored as is so it can be
+memory-mapped instead of parsed. Bump VERSION whenever the layout changes.
+"""
+
+import mmap
+import os
+import struct
+
+from data.items import Item
+from data.mobs import Bat, Lizardman, Player, Slime
+from data.quest import Quest
+from data.world import MIN_MAP_SIZE, Tile, TileGrid
+
+MAGIC = b"TOTL"
+VERSION = 2
+
+# magic, version, checked before the rest of the header, which may have another layout in other versions
+VERSION_HEADER = struct.Struct("<4sH")
+# magic, version, width, height, width and height of new levels, generator, start x, start y, floor, turn,
+# quest flags, min kills, kills until treasure, number of mobs, number of items, offset of the tile data
+HEADER = struct.Struct("<4sHIIIIBiiIIBiiIIQ")
+# x, y, hp, max hp, attack, defense, vision, level, xp, xp needed, tile, flip
+PLAYER = struct.Struct("<iiiiiidiiiBB")
+# kind, tile, flip, x, y, hp, max hp, attack, defense, vision, speed, xp, treasure drop rate
+MOB = struct.Struct("<BBBiiiiiididd")
+# tile, x, y
+ITEM = struct.Struct("<Bii")
+
+MOB_KINDS = (Slime, Bat, Lizardman)  # index is the kind stored in MOB records
+GENERATOR_KINDS = ("classic", "rooms")  # index is the generator stored in the header, names from world.GENERATORS
+TILE_IDS = {tile.value for tile in Tile}
+
+
+class SaveError(Exception):
+    pass
+
+
+def save_game(game, path):
+    """ Writes the level, the player, monsters, items and quest progress of game to path. """
+    world = game.world
+    player = game.player
+    mobs = [mob for mob in world.mobs if mob is not player]
+    items = list(world.items)
+    tiles = world.tiles
+
+    quest = game.quest
+    quest_flags = quest.has_sword | quest.has_shield << 1 | quest.has_crown << 2
+    tile_offset = HEADER.size + PLAYER.size + MOB.size*len(mobs) + ITEM.size*len(items)
+    if world.generator not in GENERATOR_KINDS:
+        raise SaveError(f"can't save levels of generator {world.generator}")
+    records = [HEADER.pack(MAGIC, VERSION, tiles.width, tiles.height, *world.level_size,
+                           GENERATOR_KINDS.index(world.generator), *world.start_pos, game.floor, game.turn,
+                           quest_flags, quest.min_kills_until_treasure, quest.kills_until_treasure,
+                           len(mobs), len(items), tile_offset)]
+    records.append(PLAYER.pack(player.x, player.y, player.hp, player.max_hp, player.attack_power,
+                               player.defense_power, player.vision, player.level, player.xp, player.xp_needed,
+                               player.tile.value, player.flip_h))
+    for mob in mobs:
+        records.append(MOB.pack(mob_kind(mob), mob.tile.value, mob.flip_h, mob.x, mob.y, mob.hp, mob.max_hp,
+                                mob.attack_power, mob.defense_power, mob.vision, mob.speed, mob.xp,
+                                getattr(mob, "treasure_drop_rate", 0)))
+    for item in items:
+        records.append(ITEM.pack(item.tile.value, item.x, item.y))
+
+    # write a new file and swap it in, the level may be memory-mapped from the old one by load_game
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(b"".join(records))
+            f.write(tiles.cells)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def mob_kind(mob):
+    # mobs in the entity store are instances of a view subclass of their kind
+    for kind, cls in enumerate(MOB_KINDS):
+        if isinstance(mob, cls):
+            return kind
+    raise SaveError(f"can't save mobs of type {type(mob).__name__}")
+
+
+def load_game(game, path, use_mmap=True):
+    """ Replaces the level, player, monsters, items and quest progress of game with the ones saved in path.
+    With use_mmap the tile data is mapped from the file, copy on write, instead of read into memory. """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < VERSION_HEADER.size:
+            raise SaveError(f"{path} is not a save file")
+        if use_mmap:
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+        else:
+            data = memoryview(bytearray(f.read()))
+
+    magic, version = VERSION_HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SaveError(f"{path} is not a save file")
+    if version != VERSION:
+        raise SaveError(f"{path} was saved by version {version} of the game, this is version {VERSION}")
+    if len(data) < HEADER.size:
+        raise SaveError(f"{path} is truncated")
+    (magic, version, width, height, level_width, level_height, generator, start_x, start_y, floor, turn, quest_flags,
+     min_kills, kills_until_treasure, num_mobs, num_items, tile_offset) = HEADER.unpack_from(data)
+    if min(level_width, level_height) < MIN_MAP_SIZE or generator >= len(GENERATOR_KINDS):
+        raise SaveError(f"{path} is corrupt")
+    if tile_offset != HEADER.size + PLAYER.size + MOB.size*num_mobs + ITEM.size*num_items:
+        raise SaveError(f"{path} is corrupt")
+    if len(data) != tile_offset + width*height:
+        raise SaveError(f"{path} is truncated")
+
+    # read and check every record before touching the game, so a bad file leaves it as it was
+    offset = HEADER.size
+    player_record = PLAYER.unpack_from(data, offset)
+    offset += PLAYER.size
+    mob_records = []
+    for i in range(num_mobs):
+        mob_records.append(MOB.unpack_from(data, offset))
+        offset += MOB.size
+    item_records = []
+    for i in range(num_items):
+        item_records.append(ITEM.unpack_from(data, offset))
+        offset += ITEM.size
+    tile_ids = [player_record[10]] + [record[1] for record in mob_records] + [record[0] for record in item_records]
+    if any(tile not in TILE_IDS for tile in tile_ids) or any(record[0] >= len(MOB_KINDS) for record in mob_records):
+        raise SaveError(f"{path} is corrupt")
+    positions = [player_record[:2]] + [record[3:5] for record in mob_records] + [record[1:] for record in item_records]
+    if any(not (0 <= x < width and 0 <= y < height) for x, y in positions):
+        raise SaveError(f"{path} is corrupt")
+
+    quest = Quest()
+    quest.has_sword = bool(quest_flags & 1)
+    quest.has_shield = bool(quest_flags & 2)
+    quest.has_crown = bool(quest_flags & 4)
+    quest.min_kills_until_treasure = min_kills
+    quest.kills_until_treasure = kills_until_treasure
+    game.quest = quest
+    game.floor = floor
+    game.turn = turn
+
+    # a new world, so the levels after this one are made like the ones of the saved game, not of the game replaced
+    game.new_world(level_width, level_height, GENERATOR_KINDS[generator], generate=False)
+    world = game.world
+    world.load_level(TileGrid(width, height, cells=data[tile_offset:]), (start_x, start_y))
+    world.start_next_level()
+
+    x, y, hp, max_hp, attack, defense, vision, level, xp, xp_needed, tile, flip_h = player_record
+    player = Player(world, game)
+    player.hp = hp
+    player.max_hp = max_hp
+    player.attack_power = attack
+    player.defense_power = defense
+    player.vision = vision
+    player.level = level
+    player.xp = xp
+    player.xp_needed = xp_needed
+    player.tile = Tile(tile)
+    player.flip_h = bool(flip_h)
+    world.add_mob_at(player, x, y)
+    game.player = player
+
+    for kind, tile, flip_h, x, y, hp, max_hp, attack, defense, vision, speed, xp, drop_rate in mob_records:
+        mob = MOB_KINDS[kind](world, game, Tile(tile), max_hp, attack, defense, player)
+        mob.hp = hp
+        mob.vision = vision
+        mob.speed = speed
+        mob.xp = xp
+        mob.flip_h = bool(flip_h)
+        if isinstance(mob, Lizardman):
+            mob.treasure_drop_rate = drop_rate
+        world.add_mob_at(mob, x, y)
+
+    for tile, x, y in item_records:
+        item = Item(Tile(tile))
+        item.x = x
+        item.y = y
+        world.items.add(item)
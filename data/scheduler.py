@@ -0,0 +1,75 @@
+from heapq import heappop, heappush
+from time import perf_counter
+
+ACTION_COST = 100  # energy an action costs, a mob with speed 100 acts once per player turn
+TICKS_PER_TURN = 600  # time resolution, divisible by the speeds used so turns don't drift
+WAKE_DISTANCE = 12  # mobs this close to the player are woken up
+SLEEP_DISTANCE = 16  # mobs further than this that the player can't see go dormant
+
+
+class TurnScheduler:
+    """ Decides which mobs act each player turn, and how often, from their speed.
+    Awake mobs are kept in a priority queue keyed by the time of their next action, so a turn only costs the
+    actions actually taken. Each action costs energy (ACTION_COST unless update() returns another cost), and a mob
+    with speed s gets s energy per turn, so slow slimes act every other turn and fast bats three times in two turns.
+    Mobs far from the player go dormant and are not scheduled at all until the player comes near again. """
+    def __init__(self, world):
+        self.world = world
+        self.time = 0
+        self.queue = []  # (time of next action, tie breaker, mob)
+        self.awake = set()
+        self.count = 0
+
+    def wake(self, mob):
+        if mob not in self.awake:
+            self.awake.add(mob)
+            # start somewhere within the mob's first action so slow mobs don't all move in step
+            delay = ACTION_COST * TICKS_PER_TURN // mob.speed
+            self.schedule(mob, self.time + self.world.rng.ai.randrange(delay))
+
+    def schedule(self, mob, time):
+        self.count += 1
+        heappush(self.queue, (time, self.count, mob))
+
+    def wake_near(self, player):
+        r = WAKE_DISTANCE
+        for mob in self.world.mobs.in_rect(player.x - r, player.y - r, 2*r + 1, 2*r + 1):
+            if mob is not player and mob not in self.awake:
+                self.wake(mob)
+
+    def run_turn(self, player):
+        """ Runs every mob action that falls in this turn, in order. Returns False if the player died, in which case
+        the rest of the turn is skipped. """
+        self.wake_near(player)
+        end = self.time + TICKS_PER_TURN
+        fov = self.world.fov
+        queue = self.queue
+        profiler = self.world.profiler
+        if profiler is not None and not profiler.enabled:
+            profiler = None
+
+        while len(queue) > 0 and queue[0][0] < end:
+            time, count, mob = heappop(queue)
+            if not mob.alive():
+                self.awake.discard(mob)
+                continue
+            if max(abs(mob.x - player.x), abs(mob.y - player.y)) > SLEEP_DISTANCE and not fov.is_visible(mob.x, mob.y):
+                self.awake.discard(mob)  # dormant until wake_near finds it again
+                continue
+
+            if profiler is None:
+                cost = mob.update()
+            else:
+                start = perf_counter()
+                cost = mob.update()
+                profiler.add(f"ai/{type(mob).__name__}", perf_counter() - start)
+            if cost == None:
+                cost = ACTION_COST
+            self.schedule(mob, time + cost * TICKS_PER_TURN // mob.speed)
+
+            if player.hp <= 0:
+                self.time = end
+                return False
+
+        self.time = end
+        return True
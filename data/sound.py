@@ -0,0 +1,84 @@
+import pygame as pg
+
+from data.assets import Assets
+
+RESERVED_CHANNELS = 4  # mixer channels kept for the dispatcher
+
+# when every channel is busy, a sound can only cut off one with a lower priority
+SOUND_PRIORITY = {
+    "game_over_sound": 3,
+    "win_sound": 3,
+    "powerup_sound": 2,
+    "up_stairs_sound": 2,
+    "select_sound": 2,
+    "heal_sound": 2,
+    "hit_sound": 1,
+    "bump_sound": 0,
+    "step_sound": 0,
+}
+
+
+class SoundDispatcher:
+    """ Sits between the game and the mixer so a busy turn costs a few mixer calls instead of one per mob.
+    Sounds are queued with play() and only played by flush(), once per frame. Sounds made on a tile the player
+    can't see are dropped, a sound queued many times in a frame is played once, and the rest share a fixed pool of
+    reserved mixer channels, where a sound can take over a channel playing a lower priority sound. """
+    def __init__(self, num_channels=RESERVED_CHANNELS):
+        self.num_channels = num_channels
+        self.channels = None  # made on first flush, the mixer may not be ready before
+        self.priorities = []  # priority of what each channel is playing
+        self.queue = {}  # sound name -> tiles it was made on, None for sounds heard everywhere
+
+    def play(self, name, x=None, y=None):
+        """ Queues the Assets sound called name, made on tile (x, y) if given. """
+        if x is None:
+            self.queue[name] = None
+        else:
+            tiles = self.queue.setdefault(name, [])
+            if tiles is not None:
+                tiles.append((x, y))
+
+    def clear(self):
+        self.queue = {}
+
+    def flush(self, world=None, player=None):
+        """ Plays the sounds queued since the last flush. world and player are needed to hear sounds made on tiles. """
+        if len(self.queue) == 0:
+            return
+        queue = self.queue
+        self.queue = {}
+
+        if world is not None:
+            world.update_fov(player)
+        names = []
+        for name, tiles in queue.items():
+            if tiles is None or (world is not None and any(world.fov.is_visible(x, y) for x, y in tiles)):
+                names.append(name)
+        names.sort(key=lambda name: -SOUND_PRIORITY.get(name, 0))
+
+        for name in names:
+            self.play_now(name)
+
+    def play_now(self, name):
+        sound = getattr(Assets, name)
+        if not isinstance(sound, pg.mixer.Sound) or not pg.mixer.get_init():
+            sound.play()  # no mixer, or a NullSound
+            return
+
+        if self.channels is None:
+            pg.mixer.set_reserved(self.num_channels)
+            self.channels = [pg.mixer.Channel(i) for i in range(self.num_channels)]
+            self.priorities = [0] * self.num_channels
+
+        # a free channel, or else the one playing the least important sound if this one is more important
+        priority = SOUND_PRIORITY.get(name, 0)
+        best = None
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                best = i
+                break
+            if self.priorities[i] < priority and (best is None or self.priorities[i] < self.priorities[best]):
+                best = i
+        if best is not None:
+            self.channels[best].play(sound)
+            self.priorities[best] = priority
@@ -0,0 +1,134 @@
+from array import array
+from itertools import chain
+import re
+
+import pygame as pg
+
+
+class SpatialGroup(pg.sprite.Group):
+    """ Sprite group that also indexes its sprites by tile position, so looking up what is on a tile is O(1).
+    Only one sprite is indexed per tile. Sprites must have their x and y set before being added, and must be
+    moved with move() so the index stays in sync. Removing a sprite (remove, kill, empty) unindexes it.
+    If given a FreeCells index, the tiles taken by the group's sprites are kept out of it.
+    on_remove is called with every sprite that leaves the group. """
+    def __init__(self, *sprites, free=None, on_remove=None):
+        self.cells = {}
+        self.free = free
+        self.on_remove = on_remove
+        super().__init__(*sprites)
+
+    def add_internal(self, sprite, layer=None):
+        super().add_internal(sprite, layer)
+        pos = (sprite.x, sprite.y)
+        self.cells[pos] = sprite
+        if self.free is not None:
+            self.free.occupy(pos)
+
+    def remove_internal(self, sprite):
+        super().remove_internal(sprite)
+        pos = (sprite.x, sprite.y)
+        if self.cells.get(pos) is sprite:
+            del self.cells[pos]
+        if self.free is not None:
+            self.free.vacate(pos)
+        if self.on_remove is not None:
+            self.on_remove(sprite)
+
+    def get(self, x, y):
+        return self.cells.get((x, y))
+
+    def move(self, sprite, x, y):
+        if sprite in self.spritedict:
+            pos = (sprite.x, sprite.y)
+            if self.cells.get(pos) is sprite:
+                del self.cells[pos]
+            self.cells[(x, y)] = sprite
+            if self.free is not None:
+                self.free.vacate(pos)
+                self.free.occupy((x, y))
+        sprite.x = x
+        sprite.y = y
+
+    def in_rect(self, left, top, width, height):
+        """ Yields the sprites whose tile is inside the given rectangle of tiles. """
+        right = left + width
+        bottom = top + height
+        if width * height <= len(self.cells):
+            # small rect, probe each tile
+            cells = self.cells
+            for y in range(top, bottom):
+                for x in range(left, right):
+                    sprite = cells.get((x, y))
+                    if sprite is not None:
+                        yield sprite
+        else:
+            # big rect, cheaper to check every sprite
+            for (x, y), sprite in list(self.cells.items()):
+                if left <= x < right and top <= y < bottom:
+                    yield sprite
+
+
+class FreeCells:
+    """ The walkable tiles of a level with nothing on them, kept as a packed array of flat cell indices (y*width + x)
+    plus an array of width*height giving each cell's slot in it, or -1. Adding, removing and picking a uniformly
+    random free tile are all O(1), and the arrays take a few bytes per tile where tuples in a list and a dict would
+    take a hundred or so, which matters on levels with millions of tiles.
+    SpatialGroups given this index call occupy() and vacate() as their sprites come, go and move. """
+    def __init__(self, tiles):
+        self.tiles = tiles
+        self.width = tiles.width
+        self.counts = {}  # number of sprites on each occupied tile
+
+        # find the runs of walkable tiles with a regex over the mask, much faster than checking every tile on big maps.
+        # Spelled with a literal first byte so the regex engine skips through the walls with a fast search
+        runs = re.finditer(b"\x01\x01*", tiles.walkable_mask())
+        self.cells = array("I", chain.from_iterable(range(*run.span()) for run in runs))
+        self.slots = array("i", [-1]) * (tiles.width * tiles.height)
+        slots = self.slots
+        for slot, i in enumerate(self.cells):
+            slots[i] = slot
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __contains__(self, pos):
+        return self.slots[pos[1]*self.width + pos[0]] != -1
+
+    def add(self, pos):
+        i = pos[1]*self.width + pos[0]
+        if self.slots[i] == -1:
+            self.slots[i] = len(self.cells)
+            self.cells.append(i)
+
+    def discard(self, pos):
+        i = pos[1]*self.width + pos[0]
+        slot = self.slots[i]
+        if slot != -1:
+            # swap the last cell into the hole so the array stays packed
+            self.slots[i] = -1
+            last = self.cells.pop()
+            if slot < len(self.cells):
+                self.cells[slot] = last
+                self.slots[last] = slot
+
+    def sample(self, rng):
+        """ Returns a random free position, or None if there are none. """
+        if len(self.cells) == 0:
+            return None
+        i = self.cells[rng.randrange(len(self.cells))]
+        return (i % self.width, i // self.width)
+
+    def occupy(self, pos):
+        count = self.counts.get(pos, 0)
+        self.counts[pos] = count + 1
+        if count == 0:
+            self.discard(pos)
+
+    def vacate(self, pos):
+        count = self.counts.get(pos, 0) - 1
+        if count > 0:
+            self.counts[pos] = count
+        else:
+            self.counts.pop(pos, None)
+            if self.tiles.is_walkable(*pos):
+                self.add(pos)
@@ -1,9 +1,19 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
-import random as rng
+import multiprocessing
+import random
+import time
 
 import pygame as pg
 
 from data.assets import Assets, TILE_SIZE
+from data.entities import EntityStore
+from data.fov import FieldOfView
+from data.pathing import FlowField
+from data.randomness import RandomStreams
+from data.scheduler import TurnScheduler
+from data.spatial import FreeCells, SpatialGroup
 
 
 class Tile(Enum):
@@ -26,19 +36,86 @@ class Tile(Enum):
     POTION = 17
 
 
+# Tile properties as lookup tables indexed by tile id. They are 256 long so they can be used with bytes.translate()
+TILES_BY_ID = [Tile.OUT_OF_BOUNDS] * 256
+for tile in Tile:
+    TILES_BY_ID[tile.value] = tile
+WALKABLE = bytes(int(TILES_BY_ID[i] in (Tile.FLOOR, Tile.UP_STAIRS)) for i in range(256))
+OPAQUE = bytes(int(TILES_BY_ID[i] in (Tile.OUT_OF_BOUNDS, Tile.WALL)) for i in range(256))
+
+
+class TileGrid:
+    """ Compact tile map, stored as one bytearray of tile ids in row order.
+    cells can also be given as any writable buffer of that layout, like a memory-mapped save file. """
+    def __init__(self, width, height, fill=Tile.WALL, cells=None):
+        self.width = width
+        self.height = height
+        if cells is None:
+            cells = bytearray([fill.value]) * (width * height)
+        self.cells = cells
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return TILES_BY_ID[self.cells[y*self.width + x]]
+        else:
+            return Tile.OUT_OF_BOUNDS
+
+    def set(self, x, y, tile):
+        self.cells[y*self.width + x] = tile.value
+
+    def fill_rect(self, r, tile):
+        if r.w == 1 and r.h > 0:
+            # a column, one strided slice
+            i = r.top*self.width + r.left
+            self.cells[i:i + (r.h - 1)*self.width + 1:self.width] = bytes([tile.value]) * r.h
+            return
+        row = bytes([tile.value]) * r.w
+        for y in range(r.top, r.bottom):
+            i = y*self.width + r.left
+            self.cells[i:i + r.w] = row
+
+    def is_walkable(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return WALKABLE[self.cells[y*self.width + x]] == 1
+        else:
+            return False
+
+    def is_opaque(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return OPAQUE[self.cells[y*self.width + x]] == 1
+        else:
+            return True
+
+    def walkable_mask(self):
+        """ Returns a bytearray with 1 for every walkable cell and 0 otherwise, in the same order as cells. """
+        return bytearray(self.cells).translate(WALKABLE)
+
+    def opaque_mask(self):
+        return bytearray(self.cells).translate(OPAQUE)
+
+
+MIN_MAP_SIZE = 10  # smallest level width and height, the biggest room plus a wall on each side
+
+
 class MazeGenerator:
+    def __init__(self, rng=None):
+        self.rng = rng if rng is not None else random.Random()
+
     def generate(self, width, height):
-        self.tiles = [[Tile.WALL for x in range(width)] for y in range(height)]
+        self.tiles = TileGrid(width, height)
         rooms = []
 
         # make empty rooms
         for i in range(5):
             for j in range(100):
                 r = pg.Rect(0, 0, 0, 0)
-                r.w = rng.randrange(4, 9)
-                r.h = rng.randrange(4, 9)
-                r.x = rng.randrange(1, width - r.w)
-                r.y = rng.randrange(1, height - r.h)
+                r.w = self.rng.randrange(4, 9)
+                r.h = self.rng.randrange(4, 9)
+                r.x = self.rng.randrange(1, width - r.w)
+                r.y = self.rng.randrange(1, height - r.h)
                 if not self.collide_any(r, rooms):
                     self.dig_room(r)
                     rooms.append(r)
@@ -49,43 +126,46 @@ class MazeGenerator:
         unconnected = rooms[1:]
 
         while len(unconnected) > 0:
-            start_room = rng.choice(connected)
-            end_room = rng.choice(unconnected)
+            start_room = self.rng.choice(connected)
+            end_room = self.rng.choice(unconnected)
             start_pos = self.random_room_pos(start_room)
             end_pos = self.random_room_pos(end_room)
             self.dig_hall(start_pos, end_pos)
             unconnected.remove(end_room)
             connected.append(end_room)
 
-        # put up stairs
-        up_stairs_room = rng.choice(rooms)
+        return self.tiles, self.place_stairs_and_start(rooms)
+
+    def place_stairs_and_start(self, rooms):
+        """ Puts up stairs in one of the rooms and returns where the player starts, in another room if there is one. """
+        up_stairs_room = self.rng.choice(rooms)
         up_stairs_pos = self.random_room_pos(up_stairs_room)
-        self.tiles[up_stairs_pos[1]][up_stairs_pos[0]] = Tile.UP_STAIRS
+        self.tiles.set(*up_stairs_pos, Tile.UP_STAIRS)
 
         # player starts in random room that is not the up stairs room
+        if len(rooms) == 1:
+            # small levels may only fit one room, start on another cell of it
+            start_pos = up_stairs_pos
+            while start_pos == up_stairs_pos:
+                start_pos = self.random_room_pos(up_stairs_room)
+            return start_pos
         rooms.remove(up_stairs_room)
-        start_room = rng.choice(rooms)
-        start_pos = self.random_room_pos(start_room)
-
-        return self.tiles, start_pos
+        start_room = self.rng.choice(rooms)
+        return self.random_room_pos(start_room)
 
     def random_room_pos(self, r):
-        return (rng.randrange(r.left, r.right), rng.randrange(r.top, r.bottom))
+        return (self.rng.randrange(r.left, r.right), self.rng.randrange(r.top, r.bottom))
 
     def dig_room(self, r):
-        for y in range(r.top, r.bottom):
-            for x in range(r.left, r.right):
-                self.tiles[y][x] = Tile.FLOOR
+        self.tiles.fill_rect(r, Tile.FLOOR)
 
     def dig_hall(self, p1, p2):
         xmin = min(p1[0], p2[0])
         xmax = max(p1[0], p2[0])
         ymin = min(p1[1], p2[1])
         ymax = max(p1[1], p2[1])
-        for x in range(xmin, xmax):
-            self.tiles[p1[1]][x] = Tile.FLOOR
-        for y in range(ymin, ymax+1):
-            self.tiles[y][p2[0]] = Tile.FLOOR
+        self.tiles.fill_rect(pg.Rect(xmin, p1[1], xmax - xmin, 1), Tile.FLOOR)
+        self.tiles.fill_rect(pg.Rect(p2[0], ymin, 1, ymax - ymin + 1), Tile.FLOOR)
 
     def collide_room(self, r1, r2):
         return (r1.right >= r2.left and r1.left <= r2.right and r1.bottom >= r2.top and r1.top <= r2.bottom)
@@ -97,90 +177,306 @@ class MazeGenerator:
         return False
 
 
-class World:
-    def __init__(self):
-        self.generator = MazeGenerator()
-        self.new_level()
+class RoomGridGenerator(MazeGenerator):
+    """ Generator for big levels with many rooms. Rooms are kept in a grid of buckets so checking a new room for
+    overlaps only looks at the rooms near it, and they are joined by a minimum spanning tree over nearby rooms, plus
+    a few extra corridors to make loops. Both cost about the same per room whatever the number of rooms. """
+    BUCKET = 10  # bucket size in tiles, at least the biggest room size plus the gap around it
+
+    def __init__(self, rng=None, num_rooms=None, extra_edges=0.1):
+        super().__init__(rng)
+        self.num_rooms = num_rooms  # default scales with the level area
+        self.extra_edges = extra_edges  # chance for each nearby pair of rooms not in the tree to get a corridor
 
+    def generate(self, width, height):
+        self.tiles = TileGrid(width, height)
+        num_rooms = self.num_rooms if self.num_rooms is not None else max(5, width*height // 150)
+        rng = self.rng
+        rand = rng.random  # int(rand() * n) is randrange(n), only faster
+        size = self.BUCKET
+        buckets = {}  # (bucket x, bucket y) -> indices of the rooms overlapping that bucket
+        rooms = self.rooms = []
+
+        # make empty rooms, giving up once 100 tries in a row don't fit
+        fails = 0
+        while len(rooms) < num_rooms and fails < 100:
+            w = 4 + int(rand() * 5)
+            h = 4 + int(rand() * 5)
+            x = 1 + int(rand() * (width - w - 1))
+            y = 1 + int(rand() * (height - h - 1))
+
+            # rooms that touch are too close, so look for rooms overlapping the room grown by a tile
+            grown = pg.Rect(x - 1, y - 1, w + 2, h + 2)
+            keys = [(bx, by) for by in range(grown.top // size, (grown.bottom - 1) // size + 1)
+                    for bx in range(grown.left // size, (grown.right - 1) // size + 1)]
+            if grown.collidelist([rooms[i] for key in keys for i in buckets.get(key, ())]) != -1:
+                fails += 1
+                continue
+            fails = 0
+
+            r = pg.Rect(x, y, w, h)
+            self.dig_room(r)
+            for key in keys:
+                if r.colliderect((key[0]*size, key[1]*size, size, size)):
+                    buckets.setdefault(key, []).append(len(rooms))
+            rooms.append(r)
+
+        # possible corridors between rooms in the same or neighbouring buckets, shortest first
+        centers = [r.center for r in rooms]
+        edges = set()
+        for (bx, by), members in buckets.items():
+            for dx, dy in ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1)):
+                others = buckets.get((bx + dx, by + dy))
+                if others is not None:
+                    for i in members:
+                        for j in others:
+                            if i < j:
+                                edges.add((i, j))
+                            elif j < i:
+                                edges.add((j, i))
+        weighted = []
+        for i, j in edges:
+            (x1, y1), (x2, y2) = centers[i], centers[j]
+            weighted.append((abs(x1 - x2) + abs(y1 - y2), i, j))
+        weighted.sort()
+
+        # Kruskal's minimum spanning tree, some of the edges left over are dug too to make loops
+        parent = list(range(len(rooms)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for d, i, j in weighted:
+            a = find(i)
+            b = find(j)
+            if a != b:
+                parent[a] = b
+                self.connect(rooms[i], rooms[j])
+            elif rand() < self.extra_edges:
+                self.connect(rooms[i], rooms[j])
+
+        # rooms with no neighbours end up in separate trees, join each tree to the first room
+        for i in range(1, len(rooms)):
+            a = find(i)
+            b = find(0)
+            if a != b:
+                parent[a] = b
+                self.connect(rooms[i], rooms[0])
+
+        return self.tiles, self.place_stairs_and_start(rooms)
+
+    def random_room_pos(self, r):
+        rand = self.rng.random
+        return (r.left + int(rand() * r.w), r.top + int(rand() * r.h))
+
+    def connect(self, r1, r2):
+        self.dig_hall(self.random_room_pos(r1), self.random_room_pos(r2))
+
+
+class LevelPlan:
+    """ A level ready to be loaded: its tiles and start position, and the indexes World keeps for it.
+    Making these is the slow part of a new level, which is why World can make the next one in the background. """
+    def __init__(self, tiles, start_pos):
+        self.tiles = tiles
+        self.start_pos = start_pos
+        self.fov = FieldOfView(tiles)
+        self.flow = FlowField(tiles)  # paths to the player, shared by all hunting mobs
+        self.free = FreeCells(tiles)  # walkable tiles with no mob or item, for spawning
+
+
+# level generators by name, see World's generator option
+GENERATORS = {
+    "classic": MazeGenerator,
+    "rooms": RoomGridGenerator,
+}
+
+
+def make_level(rng_state, width, height, generator="classic"):
+    """ Generates a level with a level rng in the given state. Returns its LevelPlan and the rng's state after. """
+    rng = random.Random()
+    rng.setstate(rng_state)
+    plan = LevelPlan(*GENERATORS[generator](rng).generate(width, height))
+    return plan, rng.getstate()
+
+
+# a process rather than a thread: making a big level is seconds of pure Python, which on a thread would fight the
+# game loop for the GIL the whole time. The plan comes back pickled, tens of ms for the biggest levels. Spawned
+# rather than forked, the game has SDL and loader threads running, so scripts that play with pregenerate need the
+# usual if __name__ == "__main__" guard. The process only starts on the first submit
+level_worker = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+
+class World:
+    def __init__(self, width=20, height=20, entity_store=False, rng=None, pregenerate=False, generator="classic",
+                 generate=True):
+        self.rng = rng if rng is not None else RandomStreams()  # see RandomStreams for what each stream is for
+        if width < MIN_MAP_SIZE or height < MIN_MAP_SIZE:
+            raise ValueError(f"levels must be at least {MIN_MAP_SIZE}x{MIN_MAP_SIZE} tiles, not {width}x{height}")
+        self.level_size = (width, height)  # size of newly generated levels
+        self.generator = generator  # name of the level generator in GENERATORS, "rooms" scales to huge levels
+        self.profiler = None  # Profiler timing monster AI, set by Game
+        self.use_entity_store = entity_store  # simulate monsters with array operations, see EntityStore
+        self.pregenerate = pregenerate  # make the next level in the background while this one is played
+        self.next_level = None  # future of make_level for the next level
+        self.mobs = None
+        self.items = None
+        if generate:
+            self.new_level()  # otherwise there is no level until load_level, as when loading a saved game
 
     def new_level(self):
-        self.tiles, self.start_pos = self.generator.generate(20, 20)
-        self.width = len(self.tiles[0])
-        self.height = len(self.tiles)
-        self.mobs = pg.sprite.Group()
-        self.items = pg.sprite.Group()
+        """ Loads a new level, the one made in the background if there is one. The level rng is only advanced here,
+        so the levels are the same whether they were made in the background or not. """
+        future = self.next_level
+        self.next_level = None
+        if future is not None and not future.cancel():
+            plan, state = future.result()  # waits if it isn't done, still quicker than starting over
+        else:
+            plan, state = make_level(self.rng.level.getstate(), *self.level_size, self.generator)
+        self.rng.level.setstate(state)
+        self.load_plan(plan)
+        self.start_next_level()
+
+    def start_next_level(self):
+        """ Starts making the next level in the background if pregenerate is on and it isn't under way already. """
+        if self.pregenerate and self.next_level is None:
+            self.next_level = level_worker.submit(make_level, self.rng.level.getstate(), *self.level_size, self.generator)
+
+    def close(self):
+        """ Lets go of the level and stops making the next one, when the world is replaced. """
+        if self.next_level is not None:
+            self.next_level.cancel()
+            self.next_level = None
+        self.clear_level()
+
+    def load_level(self, tiles, start_pos):
+        """ Replaces the current level with the given tile grid, with no mobs or items. """
+        self.load_plan(LevelPlan(tiles, start_pos))
+
+    def load_plan(self, plan):
+        self.clear_level()
+        self.tiles = plan.tiles
+        self.start_pos = plan.start_pos
+        self.fov = plan.fov
+        self.flow = plan.flow
+        self.width = self.tiles.width
+        self.height = self.tiles.height
+        self.free = plan.free
+        self.scheduler = TurnScheduler(self)
+        self.entities = EntityStore(self) if self.use_entity_store else None
+        self.mobs = SpatialGroup(free=self.free, on_remove=self.entities.detach if self.entities is not None else None)
+        self.items = SpatialGroup(free=self.free)
+
+    def clear_level(self):
+        """ Takes the sprites out of the current level's groups. Sprites that live on, like the player, would
+        otherwise keep the old groups, and through them the old level and its indexes, alive. """
+        for group in (self.mobs, self.items):
+            if group is not None:
+                # the level is going away, no need to keep its indexes up to date while emptying it
+                group.free = None
+                group.on_remove = None
+                group.empty()
+
+    def run_turn(self, player):
+        """ Lets the monsters act after the player's turn. Returns False if the player died. """
+        if self.entities is not None:
+            profiler = self.profiler
+            if profiler is None or not profiler.enabled:
+                return self.entities.run_turn(player)
+            start = time.perf_counter()
+            alive = self.entities.run_turn(player)
+            profiler.add("ai/EntityStore", time.perf_counter() - start)
+            return alive
+        else:
+            return self.scheduler.run_turn(player)
 
     def get_tile(self, x, y):
-        if 0 <= x < self.width and 0 <= y < self.height:
-            return self.tiles[y][x]
-        else:
-            return Tile.OUT_OF_BOUNDS
+        return self.tiles.get(x, y)
+
+    def update_fov(self, player):
+        """ Makes sure the field of view is up to date with the player's position. Returns True if it changed. """
+        return self.fov.update(player.x, player.y, player.vision)
 
     def get_mob(self, x, y):
-        for mob in self.mobs:
-            if mob.x == x and mob.y == y:
-                return mob
-        return None
+        return self.mobs.get(x, y)
 
     def get_item(self, x, y):
-        for item in self.items:
-            if item.x == x and item.y == y:
-                return item
-        return None
+        return self.items.get(x, y)
+
+    def move_mob(self, mob, x, y):
+        self.mobs.move(mob, x, y)
 
     def get_image(self, x, y):
         tile = self.get_tile(x, y)
         return Assets.get_tile_image(tile)
 
     def is_walkable(self, x, y):
-        tile = self.get_tile(x, y)
-        return tile == Tile.FLOOR or tile == Tile.UP_STAIRS
+        return self.tiles.is_walkable(x, y)
+
+    def walkable_mask(self):
+        return self.tiles.walkable_mask()
+
+    def free_mask(self):
+        """ Returns a mask of the cells that are walkable and have no mob or item on them. """
+        mask = self.tiles.walkable_mask()
+        for group in (self.mobs, self.items):
+            for x, y in group.cells:
+                mask[y*self.width + x] = 0
+        return mask
 
     def add_item_at_random_empty_pos(self, item):
-        for i in range(100):
-            x = rng.randrange(0, self.width)
-            y = rng.randrange(0, self.height)
-            if (x, y) != self.start_pos and self.is_walkable(x, y):
-                self.add_item_at(item, x, y)
-                break
+        pos = self.free.sample(self.rng.spawn)
+        if pos == None:
+            return False  # level is full
+        self.add_item_at(item, *pos)
+        return True
 
     def add_item_at(self, item, x, y):
-        candidates = [(x, y)]
-        checked = []
+        candidates = deque([(x, y)])
+        checked = {(x, y)}
 
         # search for the empty position nearest (x, y)
         while len(candidates) > 0:
-            p = candidates.pop(0)
-            checked.append(p)
+            p = candidates.popleft()
 
             if not self.is_walkable(*p):  # don't drop item in a wall
                 continue
-            if self.get_mob(*p) != None:  # don't drop item under a mob
-                continue
 
-            if self.get_item(*p) == None:
-                self.items.add(item)
+            if p in self.free:  # no mob or item there
                 item.x, item.y = p
-                return
+                self.items.add(item)
+                return True
             else:
                 for d in ((-1, 0), (1, 0), (0, -1), (0, 1)):
                     n = ((p[0] + d[0]), (p[1] + d[1]))
-                    if n[0] >= 0 and n[0] < self.width and n[1] >= 0 and n[1] < self.height and n not in checked:
+                    if n not in checked and 0 <= n[0] < self.width and 0 <= n[1] < self.height:
+                        checked.add(n)
                         candidates.append(n)
-
+        return False
 
     def add_mob_at_random_empty_pos(self, mob):
-        for i in range(100):
-            x = rng.randrange(0, self.width)
-            y = rng.randrange(0, self.height)
-            if (x, y) != self.start_pos and self.is_walkable(x, y) and self.get_mob(x, y) == None:
-                self.add_mob_at(mob, x, y)
-                break
+        pos = self.free.sample(self.rng.spawn)
+        if pos == None:
+            return False  # level is full
+        self.add_mob_at(mob, *pos)
+        return True
 
     def add_mob_at(self, mob, x, y):
-        self.mobs.add(mob)
         mob.x = x
         mob.y = y
+        if self.entities is not None and mob.batch_ai and not hasattr(mob, "store"):
+            self.entities.attach(mob)
+        self.mobs.add(mob)
+
+    def view_bounds(self, draw_rect, scroll_x, scroll_y):
+        """ Returns the (left, top, right, bottom) range of tiles that overlap draw_rect at the given scroll. """
+        left = max(0, (draw_rect.left - scroll_x) // TILE_SIZE)
+        top = max(0, (draw_rect.top - scroll_y) // TILE_SIZE)
+        right = min(self.width, (draw_rect.right - 1 - scroll_x) // TILE_SIZE + 1)
+        bottom = min(self.height, (draw_rect.bottom - 1 - scroll_y) // TILE_SIZE + 1)
+        return left, top, right, bottom
 
     def draw(self, surf, player, ui_size):
         # leave some space at the top for ui
@@ -190,23 +486,28 @@ class World:
         scroll_x = (surf.get_width() - TILE_SIZE) // 2 - player.x * TILE_SIZE
         scroll_y = (surf.get_height() - TILE_SIZE) // 2 - player.y * TILE_SIZE + 20  # +20 because of the ui
 
-        # draw tiles
-        for y in range(self.height):
-            for x in range(self.width):
+        # draw tiles, only the ones on screen
+        left, top, right, bottom = self.view_bounds(draw_rect, scroll_x, scroll_y)
+        for y in range(top, bottom):
+            for x in range(left, right):
                 rect = pg.Rect(scroll_x + x*TILE_SIZE, scroll_y + y*TILE_SIZE, TILE_SIZE, TILE_SIZE)
-                if rect.colliderect(draw_rect) and player.can_see(x, y):
+                if player.can_see(x, y):
                     image = self.get_image(x, y)
                     surf.blit(image, rect)
 
+        # only entities near the player can be seen
+        r = int(player.vision) + 1
+        view = (player.x - r, player.y - r, 2*r + 1, 2*r + 1)
+
         # draw items
-        for item in self.items:
+        for item in self.items.in_rect(*view):
             rect = pg.Rect(scroll_x + item.x*TILE_SIZE, scroll_y + item.y*TILE_SIZE, TILE_SIZE, TILE_SIZE)
             if rect.colliderect(draw_rect) and player.can_see(item.x, item.y):
                 image = Assets.get_tile_image(item.tile)
                 surf.blit(image, rect)
 
         # draw mobs
-        for mob in self.mobs:
+        for mob in self.mobs.in_rect(*view):
             rect = pg.Rect(scroll_x + mob.x*TILE_SIZE, scroll_y + mob.y*TILE_SIZE, TILE_SIZE, TILE_SIZE)
             if rect.colliderect(draw_rect) and player.can_see(mob.x, mob.y):
                 image = Assets.get_tile_image(mob.tile, mob.flip_h)
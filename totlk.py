@@ -1,10 +1,70 @@
 """ This module runs the game Tomb of the Lizard King, my entry for the 11th Alakajam. """
 
+import time
+start_time = time.perf_counter()  # as early as possible, for --startup-time
+
+import argparse
+
 import pygame as pg
 
-from data.game import Game
+from data.game import Game, check_spawn
+from data.headless import run_batch, run_headless_games, run_replay, summarize_results
+from data.world import GENERATORS, MIN_MAP_SIZE
+
+def spawn_setting(text):
+    """ Parses a NAME=VALUE setting for --spawn. """
+    name, _, value = text.partition("=")
+    try:
+        value = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text} is not NAME=VALUE with a number for VALUE")
+    try:
+        check_spawn({name: value})
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return name, value
+
 
 if __name__ == "__main__":
-    pg.init()
-    Game().run()
-    pg.quit()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Tomb of the Lizard King")
+    parser.add_argument("--classic-render", action="store_true", help="redraw every tile every frame instead of using the baked level renderer")
+    parser.add_argument("--fixed-fps", action="store_true", help="redraw the screen every frame instead of only when something changed")
+    parser.add_argument("--map-size", type=int, nargs=2, default=(20, 20), metavar=("WIDTH", "HEIGHT"), help="size of the levels in tiles")
+    parser.add_argument("--generator", choices=GENERATORS, default="classic", help="level generator, rooms is made for levels hundreds of tiles wide")
+    parser.add_argument("--entity-store", action="store_true", help="simulate monsters with numpy arrays, for levels with thousands of them")
+    parser.add_argument("--profile-csv", metavar="CSV", help="write the time of each phase of every frame to CSV, P shows them on screen")
+    parser.add_argument("--capture-every", type=int, metavar="N", help="save every Nth frame as a PNG in the capture directory")
+    parser.add_argument("--startup-time", action="store_true", help="print the time from start to the first frame")
+    parser.add_argument("--seed", type=int, help="seed of the games played, for reproducible runs")
+    parser.add_argument("--record", metavar="LOG", help="write an input log of the game being played to LOG, and of the next games to LOG-2, LOG-3...")
+    parser.add_argument("--replay", metavar="LOG", help="play back the game in LOG, then keep playing from there")
+    parser.add_argument("--until-turn", type=int, metavar="N", help="with --replay, stop the playback at turn N")
+    parser.add_argument("--headless", action="store_true", help="simulate games with a bot, with no display or audio, and report turns per second")
+    parser.add_argument("--turns", type=int, default=10000, help="number of turns to simulate with --headless, per game with --games")
+    parser.add_argument("--games", type=int, help="with --headless, play this many games spread over all cores and report how they went")
+    parser.add_argument("--workers", type=int, help="with --games, number of worker processes, one per core by default")
+    parser.add_argument("--spawn", type=spawn_setting, action="append", default=[], metavar="NAME=VALUE", help="override a monster and item count setting, see SPAWN in data/game.py")
+    args = parser.parse_args()
+    spawn = dict(args.spawn)
+    if min(args.map_size) < MIN_MAP_SIZE:
+        parser.error(f"--map-size must be at least {MIN_MAP_SIZE} {MIN_MAP_SIZE}")
+    if args.capture_every is not None and args.capture_every < 1:
+        parser.error("--capture-every must be at least 1")
+
+    if args.headless and args.replay:
+        result = run_replay(args.replay, args.until_turn)
+        print(f"state: {result['state']}  turns: {result['turns']}  floor: {result['floor']}  turns/s: {result['turns'] / result['seconds']:.0f}")
+    elif args.headless and args.games:
+        results = run_batch(args.games, args.turns, args.seed, args.workers, map_size=tuple(args.map_size), entity_store=args.entity_store,
+                            generator=args.generator, spawn=spawn)
+        print("  ".join(f"{name}: {value:g}" for name, value in summarize_results(results).items()))
+    elif args.headless:
+        results, turns_per_second = run_headless_games(args.turns, args.seed, map_size=tuple(args.map_size), entity_store=args.entity_store,
+                                                         generator=args.generator, spawn=spawn)
+        print(f"games: {len(results)}  turns: {sum(r['turns'] for r in results)}  turns/s: {turns_per_second:.0f}")
+    else:
+        pg.init()
+        Game(baked_render=not args.classic_render, map_size=tuple(args.map_size), entity_store=args.entity_store, event_driven=not args.fixed_fps, start_time=start_time if args.startup_time else None,
+             seed=args.seed, record=args.record, generator=args.generator, profile_csv=args.profile_csv,
+             capture_every=args.capture_every, spawn=spawn).run(args.replay, args.until_turn)
+        pg.quit()